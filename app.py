@@ -1,61 +1,357 @@
 import datetime
+import functools
+import glob
+import hashlib
+import json
 import os
 
-from flask import Flask, abort, render_template
+from flask import (
+    Flask,
+    abort,
+    make_response,
+    render_template,
+    request,
+    send_file,
+    url_for,
+)
+from werkzeug.http import is_resource_modified
 
+from blog.assets import Assets
+from blog.cache import CACHE_DIR
+from blog.images import Images
 from blog.pages import Pages
+from blog.search import build_index
+from blog.timing import TimedTemplate, TimingMiddleware, phase
+from blog.watch import watch
 
 os.environ['WERKZEUG_DEBUG_PIN'] = 'off'
 
+# Articles per listing page, and per JSON shard fetched as they scroll
+PAGE_SIZE = 50
+
+# Set to time each request's phases (see blog/timing.py): each response
+# gets a Server-Timing header, and /_timing/ shows percentiles per route
+TIMING = bool(os.environ.get('BLOG_TIMING'))
+
 app = Flask(__name__)
-pages = Pages()
+pages = Pages(os.environ.get('BLOG_PAGES_DIR', 'pages/'), watch=True, lazy=True, snapshot=True)
+assets = Assets(
+    app.static_folder,
+    app.jinja_env,
+    template_folder=os.path.join(app.root_path, app.template_folder),
+    watch=True,
+)
+images = Images(
+    os.path.join(app.static_folder, 'images'),
+    app.static_url_path + '/images',
+    os.path.join(CACHE_DIR, 'images'),
+    watch=True,
+)
+if TIMING:
+    app.jinja_env.template_class = TimedTemplate
+    app.wsgi_app = TimingMiddleware(app.wsgi_app, app.url_map)
 
 
 @app.before_request
 def reload_pages_object():
-    global pages
-    pages.reload()
+    # Cheap: only files reported by the watcher are looked at
+    with phase('reload'):
+        pages.reload()
 
 
 @app.context_processor
 def inject_pages():
     """Supply information used base template to all pages"""
+    with phase('context'):
+        return dict(
+            this_year=datetime.datetime.utcnow().year,
+            all_categories=pages.category_counts(),
+            all_tags=pages.tag_counts(),
+        )
+
+
+@app.template_global()
+def bundle(*filenames):
+    """URLs to include the given static files by: each file as it is when
+    debugging, otherwise one minified bundle of them all"""
+    if app.config.get('BUNDLE_ASSETS', not app.debug):
+        return [url_for('asset', name=assets.bundle(filenames).name)]
+    return [url_for('static', filename=filename) for filename in filenames]
+
+
+@app.template_filter()
+def responsive_images(html):
+    """Add dimensions, resized copies and lazy loading to the images in
+    an article (see blog/images.py)"""
+    with phase('images'):
+        return images.rewrite(html, lambda name: url_for('image', name=name))
+
+
+def _sources(*patterns):
+    """(path, size, mtime) of each file matching patterns"""
+    sources = []
+    for pattern in patterns:
+        for path in sorted(glob.glob(os.path.join(app.root_path, pattern), recursive=True)):
+            st = os.stat(path)
+            sources.append((os.path.relpath(path, app.root_path), st.st_size, st.st_mtime_ns))
+    return sources
+
+
+# Code can't change without a restart, but templates are reloaded
+CODE = _sources('app.py', 'blog/*.py', 'mdx_*.py', 'slugify.py')
+
+# Bumped by the watcher on every template change
+_template_generation = 0
+# (_template_generation, _sources() of the templates) when last looked at
+_templates = (None, None)
+
+
+def _template_changed(path):
+    # Watcher callback; runs in the watcher thread
+    global _template_generation
+    _template_generation += 1
+
+
+watch(os.path.join(app.root_path, app.template_folder), _template_changed, suffixes=('.html',))
+
+
+def template_sources():
+    """_sources() of the templates, looked at again only once the watcher
+    has seen one change"""
+    global _templates
+    generation, sources = _templates
+    if generation != _template_generation:
+        # Read before looking, so a change meanwhile isn't missed
+        generation = _template_generation
+        sources = _sources('templates/**/*.html')
+        _templates = (generation, sources)
+    return sources
+
+
+def conditional(view):
+    """Send an ETag and Last-Modified with the view's response, and answer
+    conditional requests that still match them with 304 Not Modified,
+    without calling the view.
+
+    Every page shows the sidebar, so any change to the index (or to the
+    templates, the asset bundles they link to, or the images articles may
+    show) changes every validator.
+    """
+
+    @functools.wraps(view)
+    def wrapper(**values):
+        sources = CODE + template_sources()
+        bundles = [bundle.name for bundle in assets.bundles()]
+        data = [
+            pages.version,
+            request.path,
+            datetime.datetime.utcnow().year,
+            sources,
+            bundles,
+            images.sources(),
+        ]
+        etag = hashlib.sha256(repr(data).encode()).hexdigest()[:32]
+        modified = max([pages.modified] + [mtime / 1e9 for _, _, mtime in sources])
+        last_modified = datetime.datetime.utcfromtimestamp(int(modified))
+
+        if request.method in ('GET', 'HEAD') and not is_resource_modified(
+            request.environ, etag=etag, last_modified=last_modified
+        ):
+            response = app.response_class(status=304)
+        else:
+            response = make_response(view(**values))
+            if response.status_code != 200:
+                return response
+        response.set_etag(etag)
+        response.last_modified = last_modified
+        # Caches may keep the page, but must check it's still current
+        response.cache_control.no_cache = True
+        return response
+
+    return wrapper
+
+
+def paginate(query, after):
+    """The first PAGE_SIZE pages from query after the page with slug after,
+    and the slug of the last one if there are more to come"""
+    try:
+        listed = query(after=after, count=PAGE_SIZE + 1)
+    except KeyError:
+        abort(404)
+    if len(listed) > PAGE_SIZE:
+        return listed[:PAGE_SIZE], listed[PAGE_SIZE - 1].slug
+    return listed, None
+
+
+def cursors(pagelist):
+    """Every 'after' slug that paginate() would lead to for pagelist"""
+    return [page.slug for page in pagelist[PAGE_SIZE - 1 : -1 : PAGE_SIZE]]
+
+
+def _more(endpoint, after, **values):
+    """Links to the rest of a listing, as a page and as JSON"""
+    if after is None:
+        return None
     return dict(
-        this_year=datetime.datetime.utcnow().year,
-        all_categories=pages.category_counts(),
-        all_tags=pages.tag_counts(),
+        html=url_for(endpoint, after=after, **values),
+        json=url_for(endpoint + '_json', after=after, **values),
+    )
+
+
+def _listing_json(query, after, endpoint, **values):
+    listed, after = paginate(query, after)
+    more = _more(endpoint, after, **values)
+    data = dict(
+        pages=[
+            dict(
+                url=url_for('page', slug=page.slug),
+                title=page.title_text,
+                date=page.date.strftime('%d-%b-%y'),
+                featured=page.featured,
+            )
+            for page in listed
+        ],
+        more=more,
+    )
+    return _json(data)
+
+
+def _json(data):
+    return app.response_class(
+        json.dumps(data, ensure_ascii=False, separators=(',', ':')),
+        mimetype='application/json',
     )
 
 
 @app.route("/")
-def index():
-    return render_template('index.html', pages=pages.all())
+@app.route('/after/<string:after>/')
+@conditional
+def index(after=None):
+    listed, after = paginate(pages.all, after)
+    return render_template('index.html', pages=listed, more=_more('index', after))
+
+
+@app.route('/after/<string:after>.json')
+@conditional
+def index_json(after):
+    return _listing_json(pages.all, after, 'index')
 
 
 @app.route('/about/')  # /about also redirects here
+@conditional
 def about():
     return render_template('about.html')
 
 
 @app.route('/featured/')
+@conditional
 def featured():
     return render_template('featured.html', pages=pages.featured())
 
 
 @app.route('/tag/<string:tag>/')
-def tag(tag):
-    tagged = pages.with_tag(tag)
-    return render_template('tag.html', pages=tagged, tag=tag)
+@app.route('/tag/<string:tag>/after/<string:after>/')
+@conditional
+def tag(tag, after=None):
+    tagged, after = paginate(functools.partial(pages.with_tag, tag), after)
+    return render_template('tag.html', pages=tagged, tag=tag, more=_more('tag', after, tag=tag))
+
+
+@app.route('/tag/<string:tag>/after/<string:after>.json')
+@conditional
+def tag_json(tag, after):
+    return _listing_json(functools.partial(pages.with_tag, tag), after, 'tag', tag=tag)
 
 
 @app.route('/category/<string:category>/')
-def category(category):
-    category = category.title()
-    catpages = pages.with_category(category)
-    return render_template('category.html', pages=catpages, category=category)
+@app.route('/category/<string:category>/after/<string:after>/')
+@conditional
+def category(category, after=None):
+    title = category.title()
+    catpages, after = paginate(functools.partial(pages.with_category, title), after)
+    more = _more('category', after, category=category)
+    return render_template('category.html', pages=catpages, category=title, more=more)
+
+
+@app.route('/category/<string:category>/after/<string:after>.json')
+@conditional
+def category_json(category, after):
+    query = functools.partial(pages.with_category, category.title())
+    return _listing_json(query, after, 'category', category=category)
+
+
+# (pages.version, index) for the most recent search index
+_search_index = (None, None)
+
+
+def search_index():
+    """The search index of the current pages, as (documents, shards)"""
+    global _search_index
+    version, index = _search_index
+    if version != pages.version:
+        version = pages.version
+        index = build_index(pages.all())
+        _search_index = (version, index)
+    return index
+
+
+@app.route('/search/')
+@conditional
+def search():
+    return render_template('search.html')
+
+
+@app.route('/search/documents.json')
+@conditional
+def search_documents():
+    documents, _ = search_index()
+    return _json([[url_for('page', slug=slug), title, date] for slug, title, date in documents])
+
+
+@app.route('/search/<string:key>.json')
+@conditional
+def search_shard(key):
+    _, shards = search_index()
+    if key not in shards:
+        abort(404)
+    return _json(shards[key])
+
+
+@app.route('/assets/<string:name>')
+def asset(name):
+    found = assets.find(name)
+    if found is None:
+        abort(404)
+    return _immutable(app.response_class(found.content, mimetype=found.mimetype))
+
+
+@app.route('/images/<string:name>')
+def image(name):
+    path = images.derivative(name)
+    if path is None:
+        abort(404)
+    return _immutable(send_file(path))
+
+
+def _immutable(response):
+    # The name changes with the content, so it can be cached for good
+    response.cache_control.public = True
+    response.cache_control.max_age = 365 * 24 * 60 * 60
+    response.cache_control.immutable = True
+    return response
+
+
+if TIMING:
+
+    @app.route('/_timing/')
+    def timing():
+        return app.response_class(
+            json.dumps(app.wsgi_app.summary(), indent=2), mimetype='application/json'
+        )
 
 
 @app.route('/<path:slug>/')
+@conditional
 def page(slug):
     try:
         page = pages[slug]
@@ -0,0 +1 @@
+"""Benchmarks for loading, rendering, serving and freezing the blog"""
@@ -0,0 +1,87 @@
+"""Benchmark the blog against synthetic corpora of several sizes.
+
+Each size runs in a fresh process, with its own corpus and an empty
+cache, and results are written as JSON tagged with the current commit so
+runs can be compared with --compare.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+
+from .corpus import generate
+
+
+def run_size(size, jobs, seed):
+    workdir = tempfile.mkdtemp(prefix='bench-{}-'.format(size))
+    corpus = os.path.join(workdir, 'pages')
+    generate(corpus, size, seed=seed)
+    env = dict(
+        os.environ,
+        BLOG_PAGES_DIR=corpus,
+        BLOG_CACHE_DIR=os.path.join(workdir, 'cache'),
+    )
+    output = subprocess.run(
+        [sys.executable, '-m', 'bench.run', corpus, '--jobs', str(jobs)],
+        env=env,
+        check=True,
+        stdout=subprocess.PIPE,
+    ).stdout
+    return json.loads(output)
+
+
+def compare(old, new):
+    """Print new/old ratio for every timing in both result sets"""
+    for size, results in sorted(new['sizes'].items(), key=lambda item: int(item[0])):
+        baseline = old['sizes'].get(size, {})
+        print("{} pages ({} vs {})".format(size, new['commit'][:10], old['commit'][:10]))
+        for key, value in sorted(results.items()):
+            if key in baseline and isinstance(value, float) and baseline[key]:
+                print("  {:<40} {:>10.3f} {:>7.2f}x".format(key, value, value / baseline[key]))
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m bench', description=__doc__)
+    parser.add_argument(
+        '--sizes',
+        default='100,1000',
+        help="comma-separated corpus sizes (default: %(default)s)",
+    )
+    parser.add_argument('--jobs', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="write results to this file, not stdout")
+    parser.add_argument('--compare', help="results file from an earlier run")
+    args = parser.parse_args()
+
+    # Results without a commit can't be told apart in --compare
+    commit = subprocess.run(
+        ['git', 'rev-parse', 'HEAD'], stdout=subprocess.PIPE, universal_newlines=True
+    ).stdout.strip()
+    commit = commit or 'unknown'
+    results = {
+        'commit': commit,
+        'python': platform.python_version(),
+        'cpus': os.cpu_count(),
+        'sizes': {},
+    }
+    for size in args.sizes.split(','):
+        print("Benchmarking {} pages".format(size), file=sys.stderr)
+        results['sizes'][size] = run_size(int(size), args.jobs, args.seed)
+
+    if args.output:
+        with open(args.output, 'w') as handle:
+            json.dump(results, handle, indent=2, sort_keys=True)
+    else:
+        json.dump(results, sys.stdout, indent=2, sort_keys=True)
+        print()
+
+    if args.compare:
+        with open(args.compare) as handle:
+            compare(json.load(handle), results)
+
+
+if __name__ == '__main__':
+    main()
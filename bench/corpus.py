@@ -0,0 +1,180 @@
+"""Generate synthetic article corpora that exercise the whole pipeline.
+
+Articles mix the features real ones use: YAML front matter, prose, indented
+and fenced code, furigana, reibun blocks with annotations, u{...} unichars,
+[[...]] autolinks, and links followed by furigana. Output is deterministic
+for a given seed.
+"""
+import os
+import random
+from datetime import datetime, timedelta
+
+CATEGORIES = ('Programming', 'Japanese', 'Wellbeing', 'Unicode')
+TAGS = ('perl', 'python', 'dart', 'git', 'unicode', 'grammar', 'vocab', 'books', 'featured')
+
+WORDS = (
+    'the quick brown fox jumps over lazy dog unicode string character code point '
+    'sentence grammar verb form past tense example commit branch merge regex '
+    'function module variable habit reading kanji kana furigana particle'
+).split()
+
+# (kanji, reading) pairs for furigana and reibun sentences
+VOCAB = (
+    ('日本語', 'にほんご'),
+    ('漢字', 'かんじ'),
+    ('東京', 'とうきょう'),
+    ('手紙', 'てがみ'),
+    ('運動', 'うんどう'),
+    ('晩御飯', 'ばんごはん'),
+    ('食堂', 'しょくどう'),
+    ('水馬', 'あめんぼ'),
+)
+
+UNICHARS = (
+    '03A3',
+    'U+03C3',
+    '00C5#+',
+    '212b#+',
+    '☃',
+    '0300\'',
+    '1F4A9!',
+    'ã',
+    'GREEK SMALL LETTER FINAL SIGMA+',
+    'PILE OF POO',
+)
+AUTOLINKS = ('perlfunc:open', 'perlunicode', 'w:Unicode', 'Unicode::Normalize', 'open::')
+
+# Links before furigana on a line, whose brackets once swallowed it
+LINKS_THEN_FURIGANA = (
+    'see [docs](http://example.com/docs) and [東京]{とうきょう}',
+    'see [[perlunicode]] then [日本語]{にほんご}',
+    'as ![a (diagram)](/static/images/a1.png) shows [漢字]{かんじ}',
+    'per [the spec][1] and [手紙]{てがみ}',
+)
+
+CODE = '''\
+def slugify(text):
+    """Make a slug from the given text"""
+    words = unidecode(text).lower().split()
+    return '-'.join(word.strip('.,!?') for word in words)
+'''
+
+# Code that looks like [furigana]{markup}
+PERL = '''\
+my $rows = $dbh->selectall_arrayref($sql, { Slice => {} });
+print $rows->[0]{name}, "\\n";
+'''
+
+
+def generate(directory, count, seed=0):
+    """Write count synthetic articles to directory"""
+    os.makedirs(directory, exist_ok=True)
+    rng = random.Random(seed)
+    start = datetime(2010, 1, 1)
+    for n in range(count):
+        date = start + timedelta(hours=rng.randrange(24 * 365 * 12))
+        path = os.path.join(directory, '{:%Y-%m-%d}-article-{}.md'.format(date, n))
+        with open(path, 'w', encoding='utf-8') as handle:
+            handle.write(_article(rng, n, date))
+
+
+def furigana_heavy(count, seed=0):
+    """count article bodies that are mostly furigana, with some code"""
+    rng = random.Random(seed)
+    return [
+        '\n\n'.join([_japanese(rng) for _ in range(20)] + [_code(rng), _reibun(rng)]) + '\n'
+        for _ in range(count)
+    ]
+
+
+def dense_reibun(annotations, seed=0):
+    """A reibun block with one sentence of the given number of annotations"""
+    rng = random.Random(seed)
+    # Every word different, as in a real breakdown
+    vocab = [
+        (chr(0x4E00 + n) + kanji, 'あ' + reading)
+        for n, (kanji, reading) in enumerate(rng.choice(VOCAB) for _ in range(annotations))
+    ]
+    sentence = 'を'.join('{}{{{}}}'.format(kanji, reading) for kanji, reading in vocab)
+    lines = ['// ' + sentence + 'した']
+    for number, (kanji, _) in enumerate(vocab, start=1):
+        lines.append('//{} {} {}'.format(number, kanji, _words(rng, 5)))
+    return '\n'.join(lines) + '\n'
+
+
+def _article(rng, n, date):
+    kanji, reading = rng.choice(VOCAB)
+    meta = [
+        "Title: '{} [{}]{{{}}} {}'".format(_words(rng, 3).title(), kanji, reading, n),
+        'Category: ' + rng.choice(CATEGORIES),
+        'Tags: ' + ', '.join(rng.sample(TAGS, rng.randint(1, 3))),
+        'Date: {:%Y-%m-%d %H:%M}'.format(date),
+    ]
+    if rng.random() < 0.02:
+        meta.append('Hidden: true')
+
+    blocks = []
+    for _ in range(rng.randint(4, 12)):
+        blocks.append(rng.choice(BLOCKS)(rng))
+    return '\n'.join(meta) + '\n\n' + '\n\n'.join(blocks) + '\n'
+
+
+def _words(rng, count):
+    return ' '.join(rng.choice(WORDS) for _ in range(count))
+
+
+def _prose(rng):
+    sentences = []
+    for _ in range(rng.randint(3, 8)):
+        sentence = _words(rng, rng.randint(6, 16)).capitalize()
+        roll = rng.random()
+        if roll < 0.2:
+            sentence += ' (u{' + rng.choice(UNICHARS) + '})'
+        elif roll < 0.35:
+            sentence += ', see [[' + rng.choice(AUTOLINKS) + ']]'
+        elif roll < 0.5:
+            sentence += ' like `{}`'.format(rng.choice(WORDS))
+        elif roll < 0.55:
+            sentence += ', ' + rng.choice(LINKS_THEN_FURIGANA)
+        sentences.append(sentence + '.')
+    return '\n'.join(sentences)
+
+
+def _japanese(rng):
+    parts = []
+    for _ in range(rng.randint(2, 6)):
+        kanji, reading = rng.choice(VOCAB)
+        if rng.random() < 0.5:
+            parts.append('{}{{{}}}'.format(kanji, reading))
+        else:
+            parts.append('[{}]{{{}}}'.format(kanji, reading))
+        parts.append(rng.choice(('を', 'に', 'は', 'で、', 'の')))
+    return ''.join(parts) + '書{か}いた。'
+
+
+def _reibun(rng):
+    vocab = rng.sample(VOCAB, 3)
+    sentence = 'あのころは、{}{{{}}}で{}を{}した'.format(
+        vocab[0][0], vocab[0][1], vocab[1][0], vocab[2][0]
+    )
+    lines = ['// ' + sentence]
+    for number, (kanji, _) in enumerate(vocab, start=1):
+        lines.append('//{} {} {}'.format(number, kanji, _words(rng, 5)))
+    lines.append('/// ' + _words(rng, 8).capitalize() + '.')
+    return '\n'.join(lines)
+
+
+def _code(rng):
+    roll = rng.random()
+    if roll < 0.4:
+        return '```python\n' + CODE + '```'
+    elif roll < 0.6:
+        return '```perl\n' + PERL + '```'
+    return '    :::python\n' + ''.join('    ' + line + '\n' for line in CODE.splitlines())
+
+
+def _list(rng):
+    return '\n'.join(' * ' + _words(rng, rng.randint(3, 8)) for _ in range(rng.randint(2, 6)))
+
+
+BLOCKS = (_prose, _prose, _prose, _japanese, _reibun, _code, _list)
@@ -0,0 +1,251 @@
+"""Time each stage of the blog against one corpus, printing JSON results.
+
+Run via `python -m bench`, which generates the corpus and points the app
+at it with BLOG_PAGES_DIR (and at a scratch cache with BLOG_CACHE_DIR)
+before this module imports anything.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from markdown import Markdown
+
+from bench.corpus import dense_reibun, furigana_heavy
+from blog.compress import compressible
+from blog.page import Page
+from blog.pages import Pages
+from blog.profiling import REGISTRIES, PipelineProfile, ProfiledEngine
+from blog.render import EXTENSION_CONFIGS, EXTENSIONS, RenderEngine, render_pages
+from blog.search import build_index
+
+# Articles used for per-extension render timings
+RENDER_SAMPLE = 200
+
+
+def timed(func, repeat=1):
+    """Best wall-clock time of repeat calls to func(), in seconds"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def bench_load(directory):
+    paths = list(Pages._walk(directory))
+    load = timed(lambda: [Page.load(path) for path in paths])
+    load_lazy = timed(lambda: [Page.load(path, lazy=True) for path in paths])
+    memory = _memory(lambda: [Page.load(path, lazy=True) for path in paths])
+    pages = None
+
+    def construct():
+        nonlocal pages
+        pages = Pages(directory)
+
+    Pages(directory, snapshot=True)  # write the snapshot outside the timing
+    return {
+        'pages': len(paths),
+        'page_load_total_s': load,
+        'page_load_per_page_ms': load * 1000 / len(paths),
+        'page_load_lazy_per_page_ms': load_lazy * 1000 / len(paths),
+        'page_memory_lazy_per_page_bytes': memory / len(paths),
+        'pages_init_s': timed(construct),
+        'pages_init_snapshot_s': timed(lambda: Pages(directory, snapshot=True), repeat=3),
+        'pages_reload_s': timed(pages.reload, repeat=3),
+    }, pages
+
+
+def _memory(func):
+    """Bytes allocated by func() and still held by its result"""
+    tracemalloc.start()
+    try:
+        result = func()
+        size, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del result
+    return size
+
+
+def bench_render(pages):
+    bodies = [page.body for page in pages.all()[:RENDER_SAMPLE]]
+    results = {'sample': len(bodies)}
+
+    results['convert_all_per_page_ms'] = _convert_time(EXTENSIONS, bodies)
+    # Each extension's cost is the profiled time of the processors it
+    # registers ('core' is Markdown's own), rather than the difference
+    # made by leaving it out, which is lost in the noise for most of them.
+    # Profiling adds overhead, so these add up to more than convert_all.
+    for name, seconds in _extension_times(bodies).items():
+        results['convert_' + name + '_per_page_ms'] = seconds * 1000 / len(bodies)
+
+    results['render_page_cold_s'] = timed(lambda: render_pages(bodies))
+    results['render_page_cached_s'] = timed(lambda: render_pages(bodies), repeat=3)
+    # Page.html renders are cached by now, so this is just the indexing
+    results['search_index_s'] = timed(lambda: build_index(pages.all()))
+    return results
+
+
+def _extension_times(bodies, repeat=3):
+    """{extension: seconds} spent converting bodies, the least of repeat
+    profiled runs"""
+    owners = _owners(EXTENSIONS, EXTENSION_CONFIGS)
+    engine = ProfiledEngine()
+    engine.convert('')  # build the pipeline outside the timing
+    best = {}
+    for _ in range(repeat):
+        profile = PipelineProfile()
+        for body in bodies:
+            profile.add(engine.profile(body)[1])
+        times = dict.fromkeys(EXTENSIONS + ('core',), 0.0)
+        for stage, name, _, seconds in profile.rows():
+            # smarty's own inline patterns are profiled as 'smarty.<name>',
+            # and abbr's patterns, registered as it goes, as 'abbr'
+            owner = owners.get((stage, name)) or owners.get(('tree', name.split('.')[0]))
+            if owner is None and name in EXTENSIONS:
+                owner = name
+            times[owner or 'core'] += seconds
+        for name, seconds in times.items():
+            best[name] = min(best.get(name, seconds), seconds)
+    return best
+
+
+def _owners(extensions, configs):
+    """{(stage, name): extension} of every processor an extension
+    registers or replaces, found by adding them one at a time"""
+
+    def processors(md):
+        return {
+            (stage, name): registry(md)[name]
+            for stage, registry in REGISTRIES
+            for name in registry(md)._data
+        }
+
+    md = Markdown()
+    owners = {}
+    before = processors(md)
+    for extension in extensions:
+        md.registerExtensions([extension], {extension: configs.get(extension, {})})
+        after = processors(md)
+        for key, item in after.items():
+            if before.get(key) is not item:
+                owners[key] = extension
+        before = after
+    return owners
+
+
+def bench_furigana(repeat=5):
+    """Furigana as an inline pattern, against the default postprocessor
+    over the whole output. The two are timed in turn, so that a slow spell
+    of the machine doesn't count against just one of them."""
+    bodies = furigana_heavy(RENDER_SAMPLE)
+    inline = dict(EXTENSION_CONFIGS, mdx_furigana={'inline': True})
+    engines = {
+        'furigana_inline_per_page_ms': _engine(EXTENSIONS, inline),
+        'furigana_postprocess_per_page_ms': _engine(EXTENSIONS),
+    }
+    results = {}
+    for _ in range(repeat):
+        for name, engine in engines.items():
+            elapsed = timed(lambda: engine.convert_many(bodies)) * 1000 / len(bodies)
+            results[name] = min(results.get(name, elapsed), elapsed)
+    return results
+
+
+def bench_reibun():
+    """Cost per annotation of dense example sentences, which should not
+    grow with the number of annotations"""
+    results = {}
+    for annotations in (100, 1000):
+        elapsed = _convert_time(EXTENSIONS, [dense_reibun(annotations)])
+        results['reibun_{}_per_annotation_ms'.format(annotations)] = elapsed / annotations
+    return results
+
+
+def _convert_time(extensions, bodies, configs=EXTENSION_CONFIGS):
+    """Per-article conversion time of a pipeline, in milliseconds"""
+    engine = _engine(extensions, configs)
+    return timed(lambda: engine.convert_many(bodies), repeat=3) * 1000 / len(bodies)
+
+
+def _engine(extensions, configs=EXTENSION_CONFIGS):
+    engine = RenderEngine(
+        extensions=extensions,
+        extension_configs={k: v for k, v in configs.items() if k in extensions},
+    )
+    engine.convert('')  # build the pipeline outside the timing
+    return engine
+
+
+def bench_freeze(jobs):
+    from app import app
+    import freeze
+
+    root = tempfile.mkdtemp(prefix='bench-build-')
+    app.config['FREEZER_DESTINATION'] = root
+    results = {
+        'jobs': jobs,
+        'freeze_full_s': timed(lambda: freeze.freeze(jobs, full=True)),
+        'freeze_noop_s': timed(lambda: freeze.freeze(jobs), repeat=3),
+    }
+    # Bytes sent for every compressible output, as is and precompressed
+    # (small outputs are only sent as is)
+    for name, suffix in (('text', ''), ('gzip', '.gz')):
+        results['build_' + name + '_bytes'] = sum(
+            os.path.getsize(path + suffix if os.path.isfile(path + suffix) else path)
+            for path in (
+                os.path.join(subdir, fn)
+                for subdir, _, filenames in os.walk(root)
+                for fn in filenames
+                if compressible(fn)
+            )
+        )
+    return results
+
+
+def bench_routes(pages, repeat):
+    from app import app
+
+    client = app.test_client()
+    some = pages.all()[0]
+    urls = {
+        'index': '/',
+        'about': '/about/',
+        'featured': '/featured/',
+        'tag': '/tag/{}/'.format(sorted(some.tags)[0]),
+        'category': '/category/{}/'.format(some.category),
+        'page': '/{}/'.format(some.slug),
+    }
+    results = {}
+    for name, url in urls.items():
+        response = client.get(url)
+        assert response.status_code == 200, (url, response.status)
+        elapsed = timed(lambda: client.get(url), repeat=repeat)
+        results['route_' + name + '_ms'] = elapsed * 1000
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('directory', help="corpus directory")
+    parser.add_argument('--jobs', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    results, pages = bench_load(args.directory)
+    results.update(bench_render(pages))
+    results.update(bench_furigana())
+    results.update(bench_reibun())
+    results.update(bench_freeze(args.jobs))
+    results.update(bench_routes(pages, args.repeat))
+    json.dump(results, sys.stdout, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
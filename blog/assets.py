@@ -0,0 +1,222 @@
+"""Bundles of static CSS and JS files, minified and named by content.
+
+Templates include static files through the bundle() template global:
+
+    {% for url in bundle('css/foundation.css', 'css/site.css') %}
+    <link rel="stylesheet" href="{{ url }}"/>
+    {% endfor %}
+
+which gives one URL per file during development, and otherwise a single
+URL for the files concatenated and minified, whose name changes whenever
+the content does (so it can be cached forever). Bundles are found by
+parsing the templates, so every one can be frozen without rendering a page.
+
+The bundles found in the templates, and each bundle, are kept until a file
+they come from changes. With watch=True that is left to a watcher on the
+static and template folders, so serving a bundle or rendering a page that
+links one touches no files; otherwise modification times are checked.
+"""
+import hashlib
+import os
+import posixpath
+import re
+from collections import namedtuple
+
+from jinja2 import nodes
+
+from .watch import watch as watch_directory
+
+Bundle = namedtuple('Bundle', 'name content mimetype')
+
+MIMETYPES = {
+    '.css': 'text/css',
+    '.js': 'text/javascript',
+}
+
+# Strings, comments, whitespace and url()s in CSS
+CSS_TOKEN_RE = re.compile(
+    r'''
+    (?P<string> "(?:[^"\\]|\\.)*" | '(?:[^'\\]|\\.)*' )
+  | (?P<comment> /\*(?!!) .*? \*/ )
+  | (?P<url> url\( \s* (?P<quote>['"]?) (?P<href>[^)'"\s]+) (?P=quote) \s* \) )
+  | (?P<space> \s+ )
+    ''',
+    re.VERBOSE | re.DOTALL,
+)
+# Punctuation that needs no whitespace around it
+CSS_PUNCTUATION = '{};,>'
+
+# Files whose changes the watchers report
+WATCHED = ('.css', '.js', '.html')
+
+# Comments that take up whole lines in JS, except /*! licence comments
+JS_COMMENT_RE = re.compile(r'^[ \t]*(?://[^\n]*|/\*(?!!)(?:[^*]|\*(?!/))*\*/[ \t]*)$', re.M)
+
+
+class Assets:
+    """The bundles of files under static_folder used by the templates in
+    jinja_env, each built when first asked for, and again if a file in it
+    changes. With watch=True, static_folder and template_folder
+    are watched for changes."""
+
+    def __init__(
+        self,
+        static_folder,
+        jinja_env,
+        template_folder=None,
+        watch=False,
+    ):
+        self.static_folder = static_folder
+        self.jinja_env = jinja_env
+        # filenames -> (stamp, Bundle)
+        self._bundles = {}
+        # (stamp, uptodate checks of the templates, files of each bundle() call)
+        self._scan = None
+        # Bumped by the watchers on every change; None when not watching
+        self._generation = None
+        if watch:
+            self._generation = 0
+            for directory in (static_folder, template_folder):
+                watch_directory(directory, self._file_changed, suffixes=WATCHED)
+
+    def bundle(self, filenames):
+        """The Bundle of the given static files"""
+        filenames = tuple(filenames)
+        if self._generation is not None:
+            stamp = self._generation
+        else:
+            stamp = [os.stat(self._path(filename)).st_mtime_ns for filename in filenames]
+        cached = self._bundles.get(filenames)
+        if cached and cached[0] == stamp:
+            return cached[1]
+        bundle = self._build(filenames)
+        self._bundles[filenames] = (stamp, bundle)
+        return bundle
+
+    def bundles(self):
+        """Every bundle() included by the templates"""
+        return [self.bundle(filenames) for filenames in self._template_bundles()]
+
+    def files(self):
+        """The static files in every bundle() included by the templates"""
+        return [
+            self._path(filename)
+            for filenames in self._template_bundles()
+            for filename in filenames
+        ]
+
+    def _template_bundles(self):
+        """The files of each constant bundle() call in the templates"""
+        if self._scan_current():
+            return self._scan[2]
+        # Read before scanning, so a change during the scan isn't missed
+        generation = self._generation
+        names = sorted(self.jinja_env.list_templates())
+        found = {}
+        checks = []
+        for name in names:
+            source, _, uptodate = self.jinja_env.loader.get_source(self.jinja_env, name)
+            if uptodate is not None:
+                checks.append(uptodate)
+            for call in self.jinja_env.parse(source).find_all(nodes.Call):
+                if (
+                    isinstance(call.node, nodes.Name)
+                    and call.node.name == 'bundle'
+                    and all(isinstance(arg, nodes.Const) for arg in call.args)
+                ):
+                    found[tuple(arg.value for arg in call.args)] = None
+        self._scan = (names if generation is None else generation, checks, list(found))
+        return self._scan[2]
+
+    def _scan_current(self):
+        if self._scan is None:
+            return False
+        stamp, checks, _ = self._scan
+        if self._generation is not None:
+            return stamp == self._generation
+        # Jinja's own checks that each template's file is unchanged
+        names = sorted(self.jinja_env.list_templates())
+        return stamp == names and all(check() for check in checks)
+
+    def _file_changed(self, path):
+        # Watcher callback; runs in the watcher thread
+        self._generation += 1
+
+    def find(self, name):
+        """The bundle named name, or None"""
+        for bundle in self.bundles():
+            if bundle.name == name:
+                return bundle
+        return None
+
+    def _build(self, filenames):
+        extensions = set(os.path.splitext(filename)[1] for filename in filenames)
+        if len(extensions) != 1 or not extensions <= MIMETYPES.keys():
+            raise Exception("can't bundle {}".format(', '.join(filenames)))
+        extension = extensions.pop()
+
+        parts = []
+        for filename in filenames:
+            with open(self._path(filename), encoding='utf-8') as handle:
+                text = handle.read()
+            if extension == '.css':
+                parts.append(minify_css(text, posixpath.dirname(filename)))
+            else:
+                parts.append(minify_js(text))
+        # A file may leave a statement unterminated
+        content = (';\n' if extension == '.js' else '\n').join(parts).encode('utf-8')
+
+        if len(filenames) == 1:
+            stem = os.path.splitext(os.path.basename(filenames[0]))[0]
+        else:
+            stem = 'bundle'
+        digest = hashlib.sha256(content).hexdigest()[:12]
+        return Bundle(stem + '.' + digest + extension, content, MIMETYPES[extension])
+
+    def _path(self, filename):
+        return os.path.join(self.static_folder, *filename.split('/'))
+
+
+def minify_css(text, directory=''):
+    """Remove comments and needless whitespace from CSS. Relative url()s
+    are made absolute, as the bundle is served from elsewhere; directory is
+    where text came from, relative to /static/."""
+
+    def token(m):
+        if m.group('comment'):
+            return ''
+        elif m.group('space'):
+            return ' '
+        elif m.group('url'):
+            href = m.group('href')
+            if not (href.startswith(('/', 'data:', '#')) or '://' in href):
+                href = posixpath.normpath(posixpath.join('/static', directory, href))
+            quote = m.group('quote')
+            return 'url(' + quote + href + quote + ')'
+        return m.group(0)
+
+    text = CSS_TOKEN_RE.sub(token, text)
+    # Strings are unaffected: spaces around punctuation were only left
+    # outside them
+    parts = re.split(r'("(?:[^"\\]|\\.)*"|\'(?:[^\'\\]|\\.)*\')', text)
+    for i in range(0, len(parts), 2):
+        part = parts[i]
+        for char in CSS_PUNCTUATION:
+            part = part.replace(' ' + char, char).replace(char + ' ', char)
+        # A space before a colon would be a descendant selector
+        parts[i] = part.replace(': ', ':').replace(';}', '}')
+    return ''.join(parts).strip()
+
+
+def minify_js(text):
+    """Remove whole-line comments, indentation and blank lines from JS.
+
+    This is deliberately cautious: lines are never joined, so automatic
+    semicolon insertion is unaffected.
+    """
+    if '`' in text:
+        # Template literals may span lines, where whitespace matters
+        return text
+    text = JS_COMMENT_RE.sub('', text)
+    lines = (line.strip() for line in text.splitlines())
+    return '\n'.join(line for line in lines if line)
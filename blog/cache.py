@@ -0,0 +1,84 @@
+"""Size-bounded on-disk cache for expensive, deterministic build output"""
+import hashlib
+import os
+import tempfile
+
+# Shared by every cache in the blog; override to relocate (e.g. in CI)
+CACHE_DIR = os.environ.get('BLOG_CACHE_DIR', '.cache')
+
+
+class DiskCache:
+    """Content-addressed text store under the given directory.
+
+    Keys are hashed, so any string will do. Entries are touched on every hit,
+    and once the directory grows past max_bytes the least recently used ones
+    are evicted. The cache is shared between processes and is best-effort:
+    any I/O failure is treated as a miss.
+    """
+
+    def __init__(self, directory, max_bytes=64 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._size = None
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, encoding='utf-8') as handle:
+                value = handle.read()
+            os.utime(path)
+        except OSError:
+            return None
+        return value
+
+    def set(self, key, value):
+        path = self._path(key)
+        data = value.encode('utf-8')
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write then rename, so concurrent readers never see partial data
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+            with os.fdopen(fd, 'wb') as handle:
+                handle.write(data)
+            os.replace(tmp, path)
+        except OSError:
+            return
+
+        if self._size is None:
+            self._size = self._disk_usage()
+        else:
+            self._size += len(data)
+        if self._size > self.max_bytes:
+            self._evict()
+
+    def _path(self, key):
+        digest = hashlib.sha256(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, digest[:2], digest[2:])
+
+    def _entries(self):
+        for subdir, _, filenames in os.walk(self.directory):
+            for fn in filenames:
+                path = os.path.join(subdir, fn)
+                try:
+                    yield path, os.stat(path)
+                except OSError:
+                    pass
+
+    def _disk_usage(self):
+        return sum(st.st_size for _, st in self._entries())
+
+    def _evict(self):
+        """Drop least recently used entries until we are under 3/4 of the limit,
+        so that we don't have to evict again on the very next write."""
+        entries = sorted(self._entries(), key=lambda entry: entry[1].st_mtime)
+        size = sum(st.st_size for _, st in entries)
+        target = self.max_bytes * 3 // 4
+        for path, st in entries:
+            if size <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            size -= st.st_size
+        self._size = size
@@ -0,0 +1,83 @@
+"""Precompressed variants of built files.
+
+freeze.py writes a gzipped copy of each text output next to it (and a
+Brotli copy if the brotli module is installed), named by adding the
+encoding's suffix, and blog/serve.py picks between them. Outputs smaller
+than MIN_SIZE are only written as they are.
+"""
+import gzip
+import os
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Outputs worth compressing, by extension
+COMPRESSIBLE = ('.html', '.json', '.xml', '.css', '.js')
+# Bytes below which an output isn't compressed: it fits in a packet either
+# way, and each copy is another file in the build
+MIN_SIZE = 1024
+
+
+def _gzip(data):
+    # mtime=0 so the same input always gives the same output
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+
+def _brotli(data):
+    return brotli.compress(data, quality=11)
+
+
+# (Content-Encoding, suffix, compress function or None if unavailable),
+# most preferred first
+ENCODINGS = [
+    ('br', '.br', _brotli if brotli else None),
+    ('gzip', '.gz', _gzip),
+]
+
+
+def compressible(filename):
+    return os.path.splitext(filename)[1] in COMPRESSIBLE
+
+
+def _worth_compressing(filename):
+    try:
+        return compressible(filename) and os.path.getsize(filename) >= MIN_SIZE
+    except OSError:
+        return False
+
+
+def variants(filename):
+    """Compressed copies written for filename, as it is now"""
+    if not _worth_compressing(filename):
+        return []
+    return [filename + suffix for _, suffix, compress in ENCODINGS if compress]
+
+
+def write_variants(filename):
+    """Write the compressed copies of filename. Copies in encodings that
+    are no longer available, or of a file now too small to compress, are
+    removed, as they would be out of date."""
+    if not compressible(filename):
+        return
+    with open(filename, 'rb') as handle:
+        data = handle.read()
+    for _, suffix, compress in ENCODINGS:
+        variant = filename + suffix
+        if compress is None or len(data) < MIN_SIZE:
+            if os.path.exists(variant):
+                os.remove(variant)
+            continue
+        compressed = compress(data)
+        try:
+            with open(variant, 'rb') as handle:
+                if handle.read() == compressed:
+                    # Keep the mtime, as Frozen-Flask does for unchanged files
+                    continue
+        except FileNotFoundError:
+            pass
+        with open(variant + '.tmp', 'wb') as handle:
+            handle.write(compressed)
+        os.replace(variant + '.tmp', variant)
+
@@ -0,0 +1,246 @@
+"""Responsive images.
+
+Images in articles are rewritten with their intrinsic width and height, so
+the page doesn't shift about as they arrive, loading="lazy", and a srcset of
+narrower copies for smaller screens:
+
+    <img alt="..." src="/static/images/map.png" width="1200" height="800"
+        srcset="/images/map.1f2e3d4c5b6a.480.png 480w, ...,
+                /static/images/map.png 1200w"
+        sizes="(max-width: 1200px) 100vw, 1200px"
+        loading="lazy" decoding="async" />
+
+The copies are made with Pillow, if it is installed, and kept in a cache
+directory under names that include a digest of the original, so each is
+only made once however many builds use it. freeze.py makes any that are
+missing across a pool of processes before building pages. Without Pillow,
+images only get lazy loading.
+
+With watch=True, the list of images is kept until a watcher on the folder
+reports a change, rather than walking the folder every time it's asked for.
+"""
+import hashlib
+import html
+import os
+import re
+import tempfile
+from collections import namedtuple
+from multiprocessing import Pool
+
+from .watch import watch as watch_directory
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+ImageInfo = namedtuple('ImageInfo', 'filename digest width height')
+
+# Widths of the copies made of each image, where narrower than the original
+WIDTHS = (480, 960, 1440)
+# Images that are resized, by extension, and the Pillow options to save them
+FORMATS = {
+    '.png': {'optimize': True},
+    '.jpg': {'quality': 82, 'optimize': True, 'progressive': True},
+    '.jpeg': {'quality': 82, 'optimize': True, 'progressive': True},
+}
+
+IMG_RE = re.compile(r'<img\b[^>]*>')
+ATTR_RE = re.compile(r'([^\s=/>]+)(?:\s*=\s*"([^"]*)")?')
+# Colours PNG copies are reduced to: screenshots resampled in full colour
+# come out larger than the originals
+PNG_COLOURS = 256
+# EXIF orientations that turn the image on its side
+ROTATED = (5, 6, 7, 8)
+
+
+class Images:
+    """The images under folder, whose URLs start with url, and their
+    resized copies in cache_dir. With watch=True, folder is watched for
+    changes."""
+
+    def __init__(self, folder, url, cache_dir, watch=False):
+        self.folder = folder
+        self.url = url.rstrip('/') + '/'
+        self.cache_dir = cache_dir
+        # filename -> ((size, mtime), ImageInfo)
+        self._info = {}
+        # (generation, ImageInfo of every image)
+        self._sources = None
+        # Bumped by the watcher on every change; None when not watching
+        self._generation = None
+        if watch:
+            self._generation = 0
+            watch_directory(folder, self._file_changed, suffixes=tuple(FORMATS))
+
+    def info(self, filename):
+        """The ImageInfo of a file in the folder, or None if it isn't an
+        image we can resize"""
+        if Image is None or os.path.splitext(filename)[1].lower() not in FORMATS:
+            return None
+        path = os.path.join(self.folder, *filename.split('/'))
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        stamp = (st.st_size, st.st_mtime_ns)
+        cached = self._info.get(filename)
+        if cached and cached[0] == stamp:
+            return cached[1]
+        try:
+            with open(path, 'rb') as handle:
+                data = handle.read()
+            # Only reads the header
+            with Image.open(path) as image:
+                width, height = image.size
+                if image.getexif().get(0x0112) in ROTATED:
+                    width, height = height, width
+        except (OSError, ValueError):
+            info = None
+        else:
+            # Copies are renamed if they'd be made differently
+            digest = hashlib.sha256(repr((FORMATS, PNG_COLOURS)).encode() + data)
+            info = ImageInfo(filename, digest.hexdigest()[:12], width, height)
+        self._info[filename] = (stamp, info)
+        return info
+
+    def sources(self):
+        """ImageInfo of every image in the folder"""
+        if self._sources is not None and self._sources[0] == self._generation:
+            return self._sources[1]
+        # Read before walking, so a change during the walk isn't missed
+        generation = self._generation
+        found = []
+        for directory, dirnames, filenames in os.walk(self.folder):
+            dirnames.sort()
+            for name in sorted(filenames):
+                path = os.path.join(directory, name)
+                filename = os.path.relpath(path, self.folder).replace(os.sep, '/')
+                info = self.info(filename)
+                if info is not None:
+                    found.append(info)
+        if generation is not None:
+            self._sources = (generation, found)
+        return found
+
+    def _file_changed(self, path):
+        # Watcher callback; runs in the watcher thread
+        self._generation += 1
+
+    def need_pillow(self):
+        """Whether images in the folder go without sizes or copies because
+        Pillow isn't installed"""
+        return Image is None and any(
+            os.path.splitext(name)[1].lower() in FORMATS
+            for _, _, filenames in os.walk(self.folder)
+            for name in filenames
+        )
+
+    def derivatives(self):
+        """{name: (ImageInfo, width)} of the copies of every image"""
+        return {
+            _name(info, width): (info, width)
+            for info in self.sources()
+            for width in _widths(info)
+        }
+
+    def derivative(self, name):
+        """Path of the copy called name, made now if it hasn't been, or None
+        if there's no such copy"""
+        found = self.derivatives().get(name)
+        if found is None:
+            return None
+        path = os.path.join(self.cache_dir, name)
+        if not os.path.isfile(path):
+            info, width = found
+            _resize((self._source(info), width, path))
+        return path
+
+    def prepare(self, jobs):
+        """Make every copy not already in the cache, in jobs processes"""
+        todo = [
+            (self._source(info), width, os.path.join(self.cache_dir, name))
+            for name, (info, width) in self.derivatives().items()
+            if not os.path.isfile(os.path.join(self.cache_dir, name))
+        ]
+        if jobs > 1 and len(todo) > 1:
+            with Pool(jobs) as pool:
+                for _ in pool.imap_unordered(_resize, todo):
+                    pass
+        else:
+            for job in todo:
+                _resize(job)
+        return len(todo)
+
+    def rewrite(self, text, url):
+        """Add dimensions, a srcset and lazy loading to the <img> tags in
+        HTML text. url(name) gives the URL of a copy."""
+
+        def tag(m):
+            tag = m.group(0)
+            attrs = dict(
+                (name.lower(), value) for name, value in ATTR_RE.findall(tag[4:])
+            )
+            extra = {}
+            src = html.unescape(attrs.get('src', ''))
+            info = None
+            if src.startswith(self.url):
+                info = self.info(src[len(self.url) :])
+            if info is not None and 'width' not in attrs and 'height' not in attrs:
+                extra['width'] = info.width
+                extra['height'] = info.height
+            if info is not None and 'srcset' not in attrs and _widths(info):
+                candidates = [
+                    '{} {}w'.format(url(_name(info, width)), width)
+                    for width in _widths(info)
+                ]
+                candidates.append('{} {}w'.format(src, info.width))
+                extra['srcset'] = ', '.join(candidates)
+                extra['sizes'] = '(max-width: {0}px) 100vw, {0}px'.format(info.width)
+            extra['loading'] = 'lazy'
+            extra['decoding'] = 'async'
+            added = ''.join(
+                ' {}="{}"'.format(name, html.escape(str(value)))
+                for name, value in extra.items()
+                if name not in attrs
+            )
+            end = re.search(r'\s*/?>$', tag).start()
+            return tag[:end] + added + tag[end:]
+
+        return IMG_RE.sub(tag, text)
+
+    def _source(self, info):
+        return os.path.join(self.folder, *info.filename.split('/'))
+
+
+def _widths(info):
+    return [width for width in WIDTHS if width < info.width]
+
+
+def _name(info, width):
+    stem, extension = os.path.splitext(os.path.basename(info.filename))
+    return '{}.{}.{}{}'.format(stem, info.digest, width, extension.lower())
+
+
+def _resize(job):
+    """Save the image at source, width pixels wide, to target"""
+    source, width, target = job
+    extension = os.path.splitext(target)[1]
+    with Image.open(source) as image:
+        image = ImageOps.exif_transpose(image)
+        image = image.convert('RGBA' if extension == '.png' else 'RGB')
+        height = max(round(image.height * width / image.width), 1)
+        resized = image.resize((width, height), Image.LANCZOS)
+    if extension == '.png':
+        resized = resized.quantize(PNG_COLOURS, method=Image.FASTOCTREE)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    # Write then rename, as processes may race to make the same copy
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(target), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as handle:
+            format = Image.registered_extensions()[extension]
+            resized.save(handle, format=format, **FORMATS[extension])
+        os.replace(tmp, target)
+    except BaseException:
+        os.remove(tmp)
+        raise
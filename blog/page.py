@@ -1,10 +1,10 @@
 """View, filter and edit markdown pages."""
 import collections
+import mmap
 import os
+import sys
 from datetime import datetime
 from html import escape as html_escape
-from itertools import takewhile
-from operator import methodcaller
 
 import dateutil.parser
 import readtime
@@ -16,7 +16,31 @@ from slugify import slugify
 
 
 class Page:
-    """Represents an article (content and metadata. Can be saved and loaded"""
+    """Represents an article (content and metadata. Can be saved and loaded.
+
+    Pages loaded lazily only parse the metadata header, and read the body
+    from the file when it is first needed.
+
+    Pages are slotted, with tag and category names interned, as a site
+    holds many of them. title_text is worked out once per title, and
+    readtime once per body.
+    """
+
+    __slots__ = (
+        '_title',
+        '_body',
+        '_body_offset',
+        '_use_mmap',
+        'category',
+        'tags',
+        'date',
+        'summary',
+        'path',
+        'slug',
+        'visible',
+        '_title_text',
+        '_readtime',
+    )
 
     def __init__(
         self,
@@ -29,11 +53,18 @@ class Page:
         summary=None,
         slug=None,
         visible=True,
+        body_offset=None,
+        use_mmap=False,
     ):
         self.title = title
-        self.body = body
+        self._body = body
+        # Byte offset of the body in the file at path, if it was loaded
+        # from one and hasn't been changed since
+        self._body_offset = body_offset
+        self._use_mmap = use_mmap
+        self._readtime = None
         self.category = category
-        self.tags = tags if tags else set()
+        self.tags = set(sys.intern(tag) for tag in tags) if tags else set()
         self.date = date if date else datetime.today()
         self.summary = summary
         self.path = path
@@ -43,12 +74,47 @@ class Page:
 
         # Normalise casing of category/tag
         if self.category:
-            self.category = self.category.title()
-            self.tags |= set([self.category.lower()])
+            self.category = sys.intern(self.category.title())
+            self.tags.add(sys.intern(self.category.lower()))
 
     def __repr__(self):
         return "Page(" + repr(self.slug) + ")"
 
+    def __getstate__(self):
+        state = {name: getattr(self, name) for name in self.__slots__}
+        if self._body_offset is not None:
+            # Don't pickle what can be re-read from the file
+            state['_body'] = None
+        return state
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+        if self.category:
+            self.category = sys.intern(self.category)
+        self.tags = set(sys.intern(tag) for tag in self.tags)
+
+    @property
+    def title(self):
+        return self._title
+
+    @title.setter
+    def title(self, title):
+        self._title = title
+        self._title_text = None
+
+    @property
+    def body(self):
+        if self._body is None and self._body_offset is not None:
+            self._body = self._read_body()
+        return self._body
+
+    @body.setter
+    def body(self, body):
+        self._body = body
+        self._body_offset = None
+        self._readtime = None
+
     @property
     def html(self):
         return render_page(self.body)
@@ -63,7 +129,9 @@ class Page:
         Returns the time it takes an average human to read this article,
         e.g. '1 min'.
         """
-        return readtime.of_text(self.body).text
+        if self._readtime is None:
+            self._readtime = readtime.of_text(self.body).text
+        return self._readtime
 
     @property
     def day_ordinal(self):
@@ -90,7 +158,13 @@ class Page:
     @property
     def title_text(self):
         """Title with furigana removed; for page title"""
-        return regex.sub(self.FURIGANA_RE, lambda m: m.group(1), self.title)
+        # Listings show this for every page they list, so keep it
+        if self._title_text is None:
+            if self.FURIGANA_RE.search(self.title):
+                self._title_text = self.FURIGANA_RE.sub(lambda m: m.group(1), self.title)
+            else:
+                self._title_text = self.title
+        return self._title_text
 
     @property
     def title_reading(self):
@@ -98,13 +172,21 @@ class Page:
         return regex.sub(self.FURIGANA_RE, lambda m: m.group(2), self.title)
 
     @classmethod
-    def load(cls, path):
-        lines = open(path)
-
-        # Read meta info until an empty line is encountered
-        meta = yaml.load(
-            '\n'.join(takewhile(methodcaller('strip'), lines)), Loader=yaml.SafeLoader
-        )
+    def load(cls, path, lazy=False, use_mmap=False):
+        """Load the page at path. If lazy, only the metadata header is read
+        now; the body is read (using mmap if requested) on first use."""
+        with open(path, 'rb') as handle:
+            # Read meta info until an empty line is encountered
+            header = []
+            for line in iter(handle.readline, b''):
+                line = _decode(line)
+                if not line.strip():
+                    break
+                header.append(line)
+            body_offset = handle.tell()
+            content = None if lazy else _decode(handle.read())
+
+        meta = yaml.load('\n'.join(header), Loader=yaml.SafeLoader)
 
         # Lowercase (standardise) key case
         meta = dict((k.lower(), v) for k, v in meta.items())
@@ -113,8 +195,6 @@ class Page:
         if title is None:
             raise Exception("Title is missing")
 
-        content = ''.join(lines)
-
         tags = {tag.strip() for tag in meta.get('tags', '').split(',')}
         tags.discard('')
 
@@ -144,6 +224,8 @@ class Page:
             summary=meta.get('summary', None),
             path=path,
             visible='hidden' not in meta,
+            body_offset=body_offset,
+            use_mmap=use_mmap,
         )
 
     # TODO(rjh) Not currently tested.
@@ -151,6 +233,8 @@ class Page:
         if not self.path:
             raise Exception("path is None, cannot save")
 
+        # Read a lazy body before the file is truncated
+        body = self.body
         with open(self.path, 'w') as handle:
             meta = collections.OrderedDict()
             meta['Title'] = self.title
@@ -174,12 +258,25 @@ class Page:
 
             handle.write(yaml.dump(meta))
             handle.write("\n")
-            handle.write(self.body)
+            handle.write(body)
+
+    def _read_body(self):
+        with open(self.path, 'rb') as handle:
+            if self._use_mmap and os.fstat(handle.fileno()).st_size:
+                with mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    return _decode(data[self._body_offset:])
+            handle.seek(self._body_offset)
+            return _decode(handle.read())
 
     def _generate_slug(self):
         return slugify(self.title_reading, max_length=70, word_boundary=True)
 
 
+def _decode(data):
+    """Decode file contents as if read in text mode (universal newlines)"""
+    return data.decode('utf-8').replace('\r\n', '\n').replace('\r', '\n')
+
+
 def _make_ordinal(n):
     '''
     Convert an integer into its ordinal representation::
@@ -1,72 +1,354 @@
 """Pages class represents one or more pages"""
+import hashlib
 import os
+import pickle
+import threading
+import time
+from bisect import bisect_left, bisect_right
 from collections import Counter
-from operator import attrgetter
+from datetime import datetime
 
+import slugify
+
+from . import page as page_module
+from .cache import CACHE_DIR
 from .page import Page
+from .watch import watch as watch_directory
 
 
 class Pages:
-    """Filterable collection of pages under the given directory"""
+    """Filterable collection of pages under the given directory.
+
+    With watch=True, a background watcher records which files changed, and
+    reload() only looks at those; it does no filesystem work at all when
+    nothing has changed. Otherwise reload() rescans the whole directory.
+
+    Visible pages are indexed by date, slug, tag and category as they are
+    loaded, so queries don't need to scan the whole collection. Two visible
+    pages with the same slug are an error.
+
+    With lazy=True, pages are loaded with Page.load(lazy=True), so only
+    their metadata is kept in memory until a body is needed.
+
+    version is a digest of the visible pages' files, the same in every
+    process with the same files, and modified is when any of the files last
+    changed, as a Unix timestamp. Both change whenever the index does.
+
+    With snapshot=True, the parsed pages are saved to the cache directory
+    whenever they change, and the next Pages for the same directory starts
+    from that snapshot, only re-parsing files whose size or mtime differ.
+    """
 
-    def __init__(self, directory='pages/'):
+    def __init__(self, directory='pages/', watch=False, lazy=False, snapshot=False):
         self._cache = {}
+        self.lazy = lazy
+        self._snapshot_path = None
+        # Pages from the snapshot not yet checked against their file
+        self._snapshot = {}
+        self._snapshot_stale = True
+        if snapshot:
+            self._snapshot_path = _snapshot_path(directory)
+            self._snapshot = _read_snapshot(self._snapshot_path)
+            self._snapshot_stale = not self._snapshot
+        self._by_date = _SortedPages()
+        self._by_slug = {}
+        self._by_tag = {}
+        self._by_category = {}
+        self._tag_counts = Counter()
+        self._category_counts = Counter()
+        self.version = None
+        self.modified = None
+        # When a file was last seen to have been deleted
+        self._deleted = None
         self.directory = directory
+        self._watcher = None
+        # Paths changed since the last reload; None means rescan everything
+        self._changed = None
+        self._changed_lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+        if watch:
+            self._watcher = watch_directory(directory, self._file_changed)
         self.reload()
 
     def reload(self):
-        paths = self._walk(self.directory)
-        pages = []
-        for path in paths:
+        changed = None
+        if self._watcher:
+            with self._changed_lock:
+                changed, self._changed = self._changed, set()
+            if changed is not None and not changed:
+                return
+
+        with self._reload_lock:
             try:
-                cached = self._cache.get(path)
-                mtime = os.path.getmtime(path)
-                if cached and cached[1] == mtime:
-                    page = cached[0]
-                else:
-                    page = Page.load(path)
-                    self._cache[path] = (page, mtime)
-                if page.visible:
-                    pages.append(page)
-            except Exception as err:
-                print("Error loading page " + path)
-                raise (err)
+                self._update(changed)
+            except Exception:
+                # Try again on the next reload
+                self._file_changed(None)
+                raise
 
-        self._pages = pages
+    def all(self, after=None, count=None):
+        """Visible pages, newest first.
 
-    def all(self):
-        return sorted(self._pages, key=attrgetter('date'), reverse=True)
+        Listings take an optional cursor: with after, they start after the
+        page with that slug (KeyError if there is none), and with count,
+        return at most that many pages.
+        """
+        return self._window(self._by_date, after, count)
 
-    def featured(self):
-        return self._filter(lambda p: p.featured)
+    def featured(self, after=None, count=None):
+        return self.with_tag('featured', after, count)
 
-    def with_tag(self, tag):
-        return self._filter(lambda p: tag in p.tags)
+    def with_tag(self, tag, after=None, count=None):
+        return self._window(self._by_tag.get(tag, _EMPTY), after, count)
 
-    def with_category(self, category):
-        return self._filter(lambda p: p.category and p.category == category)
+    def with_category(self, category, after=None, count=None):
+        return self._window(self._by_category.get(category, _EMPTY), after, count)
 
     def tag_counts(self):
-        return Counter(tag for page in self.all() for tag in page.tags)
+        return Counter(self._tag_counts)
 
     def category_counts(self):
-        return Counter(page.category for page in self.all() if page.category)
+        return Counter(self._category_counts)
 
     def __getitem__(self, key):
         if type(key) == int:
-            return self._pages[key]
+            return self._by_date[key]
+        else:
+            try:
+                return self._by_slug[key]
+            except KeyError:
+                raise KeyError("no such page") from None
+
+    def _window(self, pagelist, after, count):
+        start = 0 if after is None else pagelist.index_after(self[after])
+        stop = None if count is None else start + count
+        return pagelist[start:stop]
+
+    def _update(self, changed):
+        if changed is None:
+            paths = set(self._walk(self.directory)) | self._cache.keys()
         else:
-            for page in self.all():
-                if page.slug == key:
-                    return page
-            raise KeyError("no such page")
+            paths = changed
+
+        # Cache entries as they were, to put back if the update fails
+        previous = {}
+        removed, added = [], []
+        try:
+            for path in sorted(paths):
+                previous[path] = self._cache.get(path)
+                try:
+                    old, new = self._load(path)
+                except Exception as err:
+                    print("Error loading page " + path)
+                    raise (err)
+                if old is not new:
+                    if old and old.visible:
+                        removed.append(old)
+                    if new and new.visible:
+                        added.append(new)
+
+            if removed or added or self.version is None:
+                self._reindex(removed, added)
+                self._stamp()
+        except Exception:
+            # Keep the cache in step with the index, so that the pages are
+            # looked at again by the next reload
+            for path, entry in previous.items():
+                if entry is None:
+                    self._cache.pop(path, None)
+                else:
+                    self._cache[path] = entry
+            raise
+        if self._snapshot_path and self._snapshot_stale:
+            _write_snapshot(self._snapshot_path, self._cache)
+            self._snapshot_stale = False
+
+    def _load(self, path):
+        """(Re)load the page at path if it is new or modified, or forget it
+        if it has been deleted. Returns the old and new Page; either may be
+        None, and they are the same object if nothing changed."""
+        cached = self._cache.get(path)
+        old = cached[0] if cached else None
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            if self._cache.pop(path, None):
+                self._snapshot_stale = True
+                self._deleted = time.time()
+            return old, None
+        version = (st.st_size, st.st_mtime_ns)
+        if cached and cached[1] == version:
+            return old, old
+        snapshotted = self._snapshot.pop(path, None)
+        if snapshotted and snapshotted[1] == version:
+            new = snapshotted[0]
+        else:
+            new = Page.load(path, lazy=self.lazy)
+            self._snapshot_stale = True
+        self._cache[path] = (new, version)
+        return old, new
+
+    def _reindex(self, removed, added):
+        """Apply a batch of page changes to the indexes.
+
+        Changes are made to copies which are then swapped in, so concurrent
+        readers never see a half-updated index.
+        """
+        by_date = _SortedPages(self._by_date)
+        by_slug = dict(self._by_slug)
+        by_tag = dict(self._by_tag)
+        by_category = dict(self._by_category)
+        tag_counts = Counter(self._tag_counts)
+        category_counts = Counter(self._category_counts)
+        copied = set()
+
+        def postings(index, key):
+            if (id(index), key) not in copied:
+                copied.add((id(index), key))
+                index[key] = _SortedPages(index.get(key, ()))
+            return index[key]
+
+        for page in removed:
+            by_date.remove(page)
+            if by_slug.get(page.slug) is page:
+                del by_slug[page.slug]
+            for tag in page.tags:
+                postings(by_tag, tag).remove(page)
+                tag_counts[tag] -= 1
+            if page.category:
+                postings(by_category, page.category).remove(page)
+                category_counts[page.category] -= 1
+
+        for page in added:
+            if page.slug in by_slug:
+                raise Exception(
+                    "duplicate slug {!r} in {} and {}".format(
+                        page.slug, by_slug[page.slug].path, page.path
+                    )
+                )
+            by_date.add(page)
+            by_slug[page.slug] = page
+            for tag in page.tags:
+                postings(by_tag, tag).add(page)
+                tag_counts[tag] += 1
+            if page.category:
+                postings(by_category, page.category).add(page)
+                category_counts[page.category] += 1
+
+        for index in (by_tag, by_category):
+            for key in [key for key, pages in index.items() if not pages]:
+                del index[key]
+
+        self._by_date = by_date
+        self._by_slug = by_slug
+        self._by_tag = by_tag
+        self._by_category = by_category
+        # Keep counters in name order, so that ties in most_common() come
+        # out the same in every process
+        self._tag_counts = Counter(dict(sorted((+tag_counts).items())))
+        self._category_counts = Counter(dict(sorted((+category_counts).items())))
 
-    def _filter(self, f):
-        return filter(f, self.all())
+    def _stamp(self):
+        """Update version and modified to match the index"""
+        digest = hashlib.sha256()
+        modified = [self._deleted or 0]
+        for path, (page, (size, mtime_ns)) in sorted(self._cache.items()):
+            if page.visible:
+                digest.update('{}\0{}\0{}\0'.format(path, size, mtime_ns).encode())
+            modified.append(mtime_ns / 1e9)
+        self.version = digest.hexdigest()
+        self.modified = max(modified)
+
+    def _file_changed(self, path):
+        """Watcher callback; runs in the watcher thread"""
+        with self._changed_lock:
+            if path is None:
+                self._changed = None
+            elif self._changed is not None:
+                self._changed.add(path)
 
     @staticmethod
     def _walk(directory):
         for subdir, _, filenames in os.walk(directory):
             for fn in filenames:
                 if fn.endswith('.md'):
-                    yield subdir + os.sep + fn
+                    yield os.path.join(subdir, fn)
+
+
+def _snapshot_path(directory):
+    name = hashlib.sha256(os.path.abspath(directory).encode()).hexdigest()[:16]
+    return os.path.join(CACHE_DIR, 'pages-' + name + '.pickle')
+
+
+def _snapshot_version():
+    """Snapshots are only valid for the code that parsed them"""
+    digest = hashlib.sha256()
+    for module in (page_module, slugify):
+        with open(module.__file__, 'rb') as handle:
+            digest.update(handle.read())
+    return digest.hexdigest()
+
+
+def _read_snapshot(path):
+    try:
+        with open(path, 'rb') as handle:
+            version, pages = pickle.load(handle)
+    except Exception:
+        # Missing, corrupt or from an incompatible version: start afresh
+        return {}
+    return pages if version == _snapshot_version() else {}
+
+
+def _write_snapshot(path, pages):
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + '.tmp', 'wb') as handle:
+            pickle.dump((_snapshot_version(), pages), handle, pickle.HIGHEST_PROTOCOL)
+        os.replace(path + '.tmp', path)
+    except OSError:
+        pass
+
+
+class _SortedPages:
+    """Pages kept newest first (ties broken by path), with O(log n) search
+    for the insertion or removal point"""
+
+    def __init__(self, pages=()):
+        self._pages = list(pages)
+        if isinstance(pages, _SortedPages):
+            self._keys = list(pages._keys)
+        else:
+            self._keys = [_sort_key(page) for page in self._pages]
+
+    def add(self, page):
+        key = _sort_key(page)
+        index = bisect_left(self._keys, key)
+        self._keys.insert(index, key)
+        self._pages.insert(index, page)
+
+    def remove(self, page):
+        index = bisect_left(self._keys, _sort_key(page))
+        if index < len(self._pages) and self._pages[index] is page:
+            del self._keys[index]
+            del self._pages[index]
+
+    def index_after(self, page):
+        """Index of the first page that sorts after page"""
+        return bisect_right(self._keys, _sort_key(page))
+
+    def __iter__(self):
+        return iter(self._pages)
+
+    def __len__(self):
+        return len(self._pages)
+
+    def __getitem__(self, index):
+        return self._pages[index]
+
+
+_EMPTY = _SortedPages()
+
+
+def _sort_key(page):
+    # Time remaining until datetime.max sorts ascending as dates descend
+    return (datetime.max - page.date, page.path or '')
@@ -0,0 +1,217 @@
+"""Profile the Markdown pipeline processor by processor.
+
+ProfiledEngine converts like RenderEngine, but times every registered
+preprocessor, block processor, tree processor, inline pattern and
+postprocessor, giving a PipelineProfile per article. Report the slowest
+stages over the whole site, and the slowest articles, with:
+
+    python -m blog.profiling [--pages DIR] [--top N] [slug ...]
+
+A stage's time excludes stages run inside it, so the inline tree processor
+only accounts for walking the tree, and each inline pattern for its own
+regex searches and handleMatch calls.
+"""
+import argparse
+import time
+
+from .pages import Pages
+from .render import RenderEngine
+
+# Stage names and the Markdown attribute holding their registry
+REGISTRIES = (
+    ('pre', lambda md: md.preprocessors),
+    ('block', lambda md: md.parser.blockprocessors),
+    ('tree', lambda md: md.treeprocessors),
+    ('inline', lambda md: md.inlinePatterns),
+    ('post', lambda md: md.postprocessors),
+)
+# Methods timed for each stage
+METHODS = {
+    'pre': ('run',),
+    'block': ('test', 'run'),
+    'tree': ('run',),
+    'inline': ('handleMatch',),
+    'post': ('run',),
+}
+
+ROW = '{:<6} {:<20} {:>9} {:>10} {:>6}'
+
+
+class PipelineProfile:
+    """Calls and time spent in each (stage, name) of the pipeline, for one
+    or more conversions"""
+
+    def __init__(self):
+        # (stage, name) -> [calls, seconds]
+        self.stats = {}
+        self.total = 0.0
+        self.documents = 0
+
+    def add(self, other):
+        for key, (calls, seconds) in other.stats.items():
+            entry = self.stats.setdefault(key, [0, 0.0])
+            entry[0] += calls
+            entry[1] += seconds
+        self.total += other.total
+        self.documents += other.documents
+
+    def record(self, key, seconds):
+        entry = self.stats.setdefault(key, [0, 0.0])
+        entry[0] += 1
+        entry[1] += seconds
+
+    def rows(self):
+        """(stage, name, calls, seconds), slowest first, with the time no
+        stage accounts for as ('core', 'other')"""
+        rows = [
+            (stage, name, calls, seconds)
+            for (stage, name), (calls, seconds) in self.stats.items()
+        ]
+        rows.append(('core', 'other', self.documents, self.total - sum(row[3] for row in rows)))
+        return sorted(rows, key=lambda row: -row[3])
+
+    def report(self, top=None):
+        lines = [ROW.format('stage', 'name', 'calls', 'ms', '%')]
+        for stage, name, calls, seconds in self.rows()[:top]:
+            lines.append(
+                ROW.format(
+                    stage,
+                    name,
+                    calls,
+                    '{:.2f}'.format(seconds * 1000),
+                    '{:.1f}'.format(100 * seconds / (self.total or 1)),
+                )
+            )
+        return '\n'.join(lines)
+
+
+class ProfiledEngine(RenderEngine):
+    """RenderEngine whose pipelines are instrumented for profiling. Slower
+    than RenderEngine; not for serving."""
+
+    def profile(self, text):
+        """Render a document, returning (html, PipelineProfile)"""
+        md = self._acquire()
+        try:
+            self._reset(md)
+            _instrument(md)
+            md.profile = PipelineProfile()
+            start = time.perf_counter()
+            html = md.convert(text)
+            md.profile.total = time.perf_counter() - start
+            md.profile.documents = 1
+            return html, md.profile
+        finally:
+            self._idle.put(md)
+
+
+def _instrument(md):
+    """Wrap every processor of md with timers, including ones registered
+    later (abbr registers a pattern per abbreviation as it goes)"""
+    if getattr(md, 'profile_stack', None) is not None:
+        return
+    md.profile_stack = []
+    for stage, registry in REGISTRIES:
+        _instrument_registry(md, stage, registry(md))
+    # smarty runs its own inline tree processor, with its own patterns
+    for name in list(md.treeprocessors._data):
+        patterns = getattr(md.treeprocessors[name], 'inlinePatterns', None)
+        if patterns is not None and patterns is not md.inlinePatterns:
+            _instrument_registry(md, 'inline', patterns, name + '.')
+    md.serializer = _timed(md, ('core', 'serializer'), md.serializer)
+
+
+def _instrument_registry(md, stage, registry, prefix=''):
+    for name in list(registry._data):
+        _wrap(md, stage, prefix + name, registry[name])
+
+    register = registry.register
+
+    def registering(item, name, priority):
+        _wrap(md, stage, prefix + name, item)
+        return register(item, name, priority)
+
+    registry.register = registering
+
+
+def _wrap(md, stage, name, item):
+    # Abbreviations each get a pattern; count them as one
+    key = (stage, 'abbr' if name.startswith('abbr-') else name)
+    for method in METHODS[stage]:
+        setattr(item, method, _timed(md, key, getattr(item, method)))
+    if stage == 'inline':
+        # The inline tree processor searches with each pattern's regex
+        regex = _TimedRegex(item.getCompiledRegExp(), lambda func: _timed(md, key, func))
+        item.getCompiledRegExp = lambda: regex
+
+
+def _timed(md, key, func):
+    def wrapper(*args, **kwargs):
+        stack = md.profile_stack
+        # Time spent in stages nested in this one
+        stack.append(0.0)
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            nested = stack.pop()
+            if stack:
+                stack[-1] += elapsed
+            md.profile.record(key, elapsed - nested)
+
+    return wrapper
+
+
+class _TimedRegex:
+    """Compiled regex whose searches are timed"""
+
+    def __init__(self, regex, timed):
+        self._regex = regex
+        self._timed = timed
+        self.search = timed(regex.search)
+        self.match = timed(regex.match)
+
+    def finditer(self, *args):
+        # Only time finding each match, not what the caller does with it
+        found = self._regex.finditer(*args)
+        find = self._timed(lambda: next(found, None))
+        match = find()
+        while match is not None:
+            yield match
+            match = find()
+
+    def __getattr__(self, name):
+        return getattr(self._regex, name)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('slugs', nargs='*', help="articles to profile (default: all)")
+    parser.add_argument('--pages', default='pages/', help="pages directory")
+    parser.add_argument('--top', type=int, default=20, help="rows and articles to show")
+    args = parser.parse_args()
+
+    pages = Pages(args.pages, lazy=True)
+    selected = [pages[slug] for slug in args.slugs] if args.slugs else pages.all()
+    engine = ProfiledEngine()
+    engine.convert('')  # build the pipeline outside the timing
+
+    corpus = PipelineProfile()
+    profiles = []
+    for page in selected:
+        _, profile = engine.profile(page.body)
+        corpus.add(profile)
+        profiles.append((page, profile))
+
+    print("{} articles, {:.1f}ms".format(corpus.documents, corpus.total * 1000))
+    print(corpus.report(args.top))
+    profiles.sort(key=lambda item: -item[1].total)
+    for page, profile in profiles[: args.top if len(selected) > 1 else 1]:
+        print()
+        print("{} ({:.1f}ms)".format(page.slug, profile.total * 1000))
+        print(profile.report(5))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,321 @@
+"""Unused CSS removal and critical CSS inlining for a frozen build.
+
+Once every page is written, freeze.py collects the tags, classes and ids
+used across the HTML, and by the site's own scripts, and cuts each CSS
+bundle down to the rules that could match them. Each page then gets the
+rules it needs for its first screenful inlined in its head, and loads the
+cut-down bundle without blocking rendering:
+
+    <style data-critical="/assets/bundle.<full>.css">...</style>
+    <link rel="preload" href="/assets/bundle.<purged>.css" as="style" onload="...">
+    <noscript><link rel="stylesheet" href="/assets/bundle.<purged>.css"/></noscript>
+
+Pages kept from an earlier build aren't read again: the tags, classes and
+ids they use are remembered from last time. They are only rewritten, by
+putting them back as they were first, if the purged CSS or the CSS
+inlined in every page has changed.
+
+Rules are matched on the tags, classes and ids in their selectors, so
+pseudo-classes, attribute selectors and combinators are assumed to match.
+"""
+import hashlib
+import json
+import os
+import posixpath
+import re
+from collections import namedtuple
+
+from .compress import write_variants
+
+Rule = namedtuple('Rule', 'prelude body')
+Used = namedtuple('Used', 'tags classes ids')
+
+# Bytes of a page's <body>, from the start, taken to be above the fold
+FOLD_BYTES = 8 * 1024
+# Classes added by third-party scripts, which we can't scan
+SAFELIST = re.compile(r'^qtip')
+# At-rules holding further rules
+NESTED = ('@media', '@supports', '@document')
+
+# Strings, comments and the punctuation that gives CSS its structure
+CSS_STRUCTURE_RE = re.compile(
+    r'"(?:[^"\\]|\\.)*"|\'(?:[^\'\\]|\\.)*\'|/\*.*?\*/|[{};]', re.S
+)
+# Parts of a selector that don't name a tag, class or id
+SELECTOR_IGNORE_RE = re.compile(r'\[[^\]]*\]|::?[\w-]+(?:\((?:[^()]|\([^()]*\))*\))?')
+SELECTOR_CLASS_RE = re.compile(r'\.((?:[\w-]|\\.)+)')
+SELECTOR_ID_RE = re.compile(r'#((?:[\w-]|\\.)+)')
+SELECTOR_TAG_RE = re.compile(r'(?:^|[\s>+~(])([a-zA-Z][\w-]*)')
+
+HTML_TAG_RE = re.compile(r'<([a-zA-Z][\w-]*)([^>]*)>')
+HTML_ATTR_RE = re.compile(r'\b(class|id)\s*=\s*(?:"([^"]*)"|\'([^\']*)\')', re.I)
+JS_STRING_RE = re.compile(r'"(?:[^"\\\n]|\\.)*"|\'(?:[^\'\\\n]|\\.)*\'')
+WORD_RE = re.compile(r'[A-Za-z_][\w-]*')
+
+CRITICAL_RE = re.compile(
+    r'<style data-critical="([^"]*)">.*?</style>\n'
+    r'<link rel="preload" [^>]*>\n<noscript>.*?</noscript>',
+    re.S,
+)
+BLOCK = (
+    '<style data-critical="{original}">{critical}</style>\n'
+    '<link rel="preload" href="{href}" as="style"'
+    ' onload="this.onload=null;this.rel=\'stylesheet\'"/>\n'
+    '<noscript><link rel="stylesheet" href="{href}"/></noscript>'
+)
+LINK = '<link rel="stylesheet" href="{href}"/>'
+
+
+def parse(css):
+    """A list of Rules: prelude (selectors, or an at-rule) and body (the
+    declarations, a list of Rules for @media and the like, or None for a
+    statement such as @charset or a comment)"""
+    rules, _ = _parse(css, 0)
+    return rules
+
+
+def _parse(css, pos):
+    rules = []
+    start = pos
+    while True:
+        m = CSS_STRUCTURE_RE.search(css, pos)
+        if m is None:
+            return rules, len(css)
+        token = m.group()
+        pos = m.end()
+        if token.startswith('/*'):
+            if not css[start : m.start()].strip():
+                # A comment between rules, likely a licence
+                rules.append(Rule(token, None))
+                start = pos
+        elif token == ';':
+            statement = css[start : m.start()].strip()
+            if statement:
+                rules.append(Rule(statement, None))
+            start = pos
+        elif token == '{':
+            prelude = css[start : m.start()].strip()
+            if prelude.split(None, 1)[0].lower() in NESTED:
+                body, pos = _parse(css, pos)
+            else:
+                end = _close(css, pos)
+                body = css[pos:end]
+                pos = end + 1
+            rules.append(Rule(prelude, body))
+            start = pos
+        elif token == '}':
+            return rules, pos
+
+
+def _close(css, pos):
+    """Position of the brace closing a block whose body starts at pos"""
+    depth = 0
+    for m in CSS_STRUCTURE_RE.finditer(css, pos):
+        if m.group() == '{':
+            depth += 1
+        elif m.group() == '}':
+            if depth == 0:
+                return m.start()
+            depth -= 1
+    return len(css)
+
+
+def serialize(rules):
+    parts = []
+    for rule in rules:
+        if rule.body is None and rule.prelude.startswith('/*'):
+            parts.append(rule.prelude)
+        elif rule.body is None:
+            parts.append(rule.prelude + ';')
+        elif isinstance(rule.body, list):
+            parts.append(rule.prelude + '{' + serialize(rule.body) + '}')
+        else:
+            parts.append(rule.prelude + '{' + rule.body + '}')
+    return ''.join(parts)
+
+
+def purge(rules, used, statements=True):
+    """The rules, and selectors within them, that could match something
+    in used. Other at-rules (@font-face, @keyframes) and statements are
+    kept, unless statements is False."""
+    kept = []
+    for rule in rules:
+        if isinstance(rule.body, list):
+            body = purge(rule.body, used, statements)
+            if body:
+                kept.append(Rule(rule.prelude, body))
+        elif rule.body is None or rule.prelude.startswith('@'):
+            if statements:
+                kept.append(rule)
+        else:
+            selectors = [s for s in split_selectors(rule.prelude) if matches(s, used)]
+            if selectors:
+                kept.append(Rule(','.join(selectors), rule.body))
+    return kept
+
+
+def split_selectors(prelude):
+    """The selectors in a comma-separated list, leaving alone commas within
+    brackets or parentheses"""
+    selectors = []
+    depth = 0
+    start = 0
+    for i, char in enumerate(prelude):
+        if char in '([':
+            depth += 1
+        elif char in ')]':
+            depth -= 1
+        elif char == ',' and depth == 0:
+            selectors.append(prelude[start:i].strip())
+            start = i + 1
+    selectors.append(prelude[start:].strip())
+    return [selector for selector in selectors if selector]
+
+
+def matches(selector, used):
+    """Whether every tag, class and id named by selector is used"""
+    selector = SELECTOR_IGNORE_RE.sub('', selector)
+    for name in SELECTOR_CLASS_RE.findall(selector):
+        name = name.replace('\\', '')
+        if name not in used.classes and not SAFELIST.match(name):
+            return False
+    for name in SELECTOR_ID_RE.findall(selector):
+        if name.replace('\\', '') not in used.ids:
+            return False
+    # Classes and ids were matched above, and mustn't be taken for tags
+    selector = SELECTOR_ID_RE.sub('', SELECTOR_CLASS_RE.sub('', selector))
+    return all(tag.lower() in used.tags for tag in SELECTOR_TAG_RE.findall(selector))
+
+
+def used_in_html(html):
+    """The tags, classes and ids in an HTML document"""
+    used = Used(set(), set(), set())
+    for tag, attrs in HTML_TAG_RE.findall(html):
+        used.tags.add(tag.lower())
+        for name, double, single in HTML_ATTR_RE.findall(attrs):
+            values = (double or single).split()
+            (used.classes if name.lower() == 'class' else used.ids).update(values)
+    return used
+
+
+def used_in_js(js):
+    """Everything that could be a tag, class or id in the string literals of
+    a script, such as "<li>" or addClass("an-hover")"""
+    words = set()
+    for string in JS_STRING_RE.findall(js):
+        words.update(WORD_RE.findall(string))
+    return Used(words, words, words)
+
+
+def union(*used):
+    return Used(*(set().union(*(u[i] for u in used)) for i in range(3)))
+
+
+def intersection(used):
+    used = list(used)
+    if not used:
+        return Used(set(), set(), set())
+    return Used(*(set.intersection(*(u[i] for u in used)) for i in range(3)))
+
+
+def above_the_fold(html):
+    """The start of the page, up to FOLD_BYTES into its <body>"""
+    body = html.find('<body')
+    return html[: max(body, 0) + FOLD_BYTES]
+
+
+def restore(html):
+    """Put a page back as it was before optimise()"""
+    return CRITICAL_RE.sub(lambda m: LINK.format(href=m.group(1)), html)
+
+
+def optimise(html_files, stylesheets, scripts, changed=None, previous=None):
+    """Purge and inline the stylesheets linked from the pages in
+    html_files.
+
+    stylesheets maps the URL of each CSS bundle to its file, and scripts
+    is the text of the site's own scripts. Each purged stylesheet is
+    written next to the original.
+
+    previous is what the last call for the same build returned, if it can
+    be trusted. Pages not in changed (default: all of them) are then taken
+    to be as that call left them, and are only read if they need to be
+    rewritten. Returns the purged stylesheets' files, and the state to
+    pass as previous next time.
+    """
+    previous = previous or {}
+    known = previous.get('used', {})
+    changed = set(html_files if changed is None else changed)
+    pages = {}
+    used = {}
+    for filename in html_files:
+        if filename in changed or filename not in known:
+            pages[filename] = _read(filename)
+            used[filename] = used_in_html(pages[filename])
+        else:
+            used[filename] = Used(*(set(names) for names in known[filename]))
+    from_scripts = union(*(used_in_js(js) for js in scripts))
+    everywhere = union(from_scripts, *used.values())
+    # The header, sidebar and footer, on every page
+    chrome = intersection(used.values())
+
+    written = []
+    blocks = {}
+    for href, original in sorted(stylesheets.items()):
+        with open(original, encoding='utf-8') as handle:
+            rules = purge(parse(handle.read()), everywhere)
+        content = serialize(rules)
+        stem = os.path.basename(original).split('.', 1)[0]
+        digest = hashlib.sha256(content.encode()).hexdigest()[:12]
+        name = '{}.{}.css'.format(stem, digest)
+        filename = os.path.join(os.path.dirname(original), name)
+        _write(filename, content)
+        written.append(filename)
+        purged = posixpath.join(posixpath.dirname(href), name)
+        blocks[LINK.format(href=href)] = (href, purged, rules)
+
+    # What every page's inlined CSS depends on, besides the page itself
+    inlined = [sorted((href, purged) for href, purged, _ in blocks.values())]
+    inlined.extend(sorted(names) for names in chrome)
+    inlined = hashlib.sha256(json.dumps(inlined).encode()).hexdigest()
+    if inlined != previous.get('inlined'):
+        for filename in html_files:
+            if filename not in pages:
+                pages[filename] = _read(filename)
+
+    for filename, html in pages.items():
+        fold = union(chrome, used_in_html(above_the_fold(html)))
+        for link, (href, purged, rules) in blocks.items():
+            if link in html:
+                critical = serialize(purge(rules, fold, statements=False))
+                block = BLOCK.format(original=href, critical=critical, href=purged)
+                html = html.replace(link, block)
+        _write(filename, html)
+
+    state = {
+        'used': {filename: [sorted(names) for names in u] for filename, u in used.items()},
+        'inlined': inlined,
+    }
+    return written, state
+
+
+def _read(filename):
+    """A page, as it was before optimise()"""
+    with open(filename, encoding='utf-8') as handle:
+        return restore(handle.read())
+
+
+def _write(filename, text):
+    """Write text to filename, and its compressed variants, unless it's
+    already there"""
+    data = text.encode('utf-8')
+    try:
+        with open(filename, 'rb') as handle:
+            if handle.read() == data:
+                return
+    except FileNotFoundError:
+        pass
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    with open(filename, 'wb') as handle:
+        handle.write(data)
+    write_variants(filename)
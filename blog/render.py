@@ -1,28 +1,126 @@
+import hashlib
+import importlib.util
+import os
+import queue
+
+import markdown
+import pygments
 from markdown import Markdown
 
+from .cache import CACHE_DIR, DiskCache
+from .timing import phase
+
 EXTENSIONS = (
     'mdx_reibun',
     'mdx_unichar',
     'footnotes',
     'def_list',
     'tables',
-    'codehilite',
+    'mdx_codehilite',
     'smarty',
     'attr_list',
     'mdx_autolink',
-    'fenced_code',
+    # As fenced_code, but highlighting through mdx_codehilite's cache
+    'mdx_codehilite:FencedCodeExtension',
     'mdx_furigana',
     'abbr',
 )
 
 EXTENSION_CONFIGS = {
-    'codehilite': {
+    'mdx_codehilite': {
         'guess_lang': False,
     },
 }
 
 
+class RenderEngine:
+    """Thread-safe pool of configured Markdown instances.
+
+    Building the pipeline (importing and registering every extension) costs
+    more than converting a typical article, so instances are built on demand,
+    at most one per concurrently rendering thread, and reset for reuse
+    instead of being thrown away.
+    """
+
+    def __init__(self, extensions=EXTENSIONS, extension_configs=EXTENSION_CONFIGS):
+        self.extensions = extensions
+        self.extension_configs = extension_configs
+        self._idle = queue.LifoQueue()
+
+    def convert(self, text):
+        """Render a single Markdown document to HTML"""
+        return self.convert_many([text])[0]
+
+    def convert_many(self, texts):
+        """Render several documents using one pipeline instance"""
+        md = self._acquire()
+        try:
+            return [self._reset(md).convert(text) for text in texts]
+        finally:
+            self._idle.put(md)
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return Markdown(
+                extensions=self.extensions, extension_configs=self.extension_configs
+            )
+
+    @staticmethod
+    def _reset(md):
+        md.reset()
+        # The abbr extension registers an inline pattern per definition and
+        # never removes it, which would leak abbreviations between documents.
+        for name in [name for name in md.inlinePatterns._data if name.startswith('abbr-')]:
+            md.inlinePatterns.deregister(name)
+        return md
+
+
+engine = RenderEngine()
+_cache = DiskCache(os.path.join(CACHE_DIR, 'render'))
+_fingerprint = None
+
+
 def render_page(text):
-    """Render Markdown article with custom extension list"""
-    md = Markdown(extensions=EXTENSIONS, extension_configs=EXTENSION_CONFIGS)
-    return md.convert(text)
+    """Render Markdown article with custom extension list.
+
+    Output is cached on disk, keyed by the text and the pipeline fingerprint,
+    so unchanged articles are only rendered once across processes and builds.
+    """
+    return render_pages([text])[0]
+
+
+def render_pages(texts):
+    """Render a batch of articles, as render_page, converting any cache
+    misses in one go."""
+    with phase('markdown'):
+        keys = [pipeline_fingerprint() + '\n' + text for text in texts]
+        html = [_cache.get(key) for key in keys]
+        missing = [i for i, value in enumerate(html) if value is None]
+        if missing:
+            rendered = engine.convert_many([texts[i] for i in missing])
+            for i, value in zip(missing, rendered):
+                html[i] = value
+                _cache.set(keys[i], value)
+        return html
+
+
+def pipeline_fingerprint():
+    """Hash of everything other than the article text that affects the output:
+    the extension list and config, library versions and our own extensions'
+    source code."""
+    global _fingerprint
+    if _fingerprint is None:
+        digest = hashlib.sha256()
+        digest.update(repr(EXTENSIONS).encode())
+        digest.update(repr(sorted(EXTENSION_CONFIGS.items())).encode())
+        digest.update(markdown.__version__.encode())
+        digest.update(pygments.__version__.encode())
+        # Extensions may be named as module:Class
+        for name in sorted(set(name.split(':')[0] for name in EXTENSIONS)):
+            if name.startswith('mdx_'):
+                with open(importlib.util.find_spec(name).origin, 'rb') as handle:
+                    digest.update(handle.read())
+        _fingerprint = digest.hexdigest()
+    return _fingerprint
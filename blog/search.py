@@ -0,0 +1,144 @@
+"""Full-text search index over the visible pages.
+
+The index is served as static JSON: a list of documents, and the postings
+for each token split into shards by the token's first character, so a
+query only fetches the shards for its own tokens, and a word typed so far
+is completed from the one shard. static/js/search.js tokenizes
+queries the same way as tokenize() here.
+
+A shard grows with the site, and the shards of common letters hold much
+of the index, so one bigger than SHARD_BYTES is split by the tokens'
+first two characters. What is left of it holds its one-character tokens,
+and the keys of its parts under SPLIT. A word is then looked up in one
+part, but completing a single character means fetching them all.
+"""
+import json
+import unicodedata
+from html.parser import HTMLParser
+
+import regex
+
+# Weight of a token in a title (or its reading) relative to one in the body
+TITLE_WEIGHT = 5
+# Bytes of JSON above which a shard is split by second character
+SHARD_BYTES = 16 * 1024
+# Key listing the parts of a split shard; no token has a space
+SPLIT = ' split'
+
+# Japanese isn't written with spaces between words, so runs of Japanese
+# script are indexed as overlapping character bigrams; everything else is
+# indexed by word.
+JAPANESE = r'[\p{Han}\p{Hiragana}\p{Katakana}ー々]'
+WORD = r'[\p{Alphabetic}\p{M}\p{Nd}\p{Pc}]'
+TOKEN_RE = regex.compile(r'(?P<japanese>{0}+)|(?:(?!{0}){1})+'.format(JAPANESE, WORD))
+
+# Tags whose text runs on into the text around them
+INLINE_TAGS = {'a', 'abbr', 'b', 'code', 'em', 'i', 'rb', 'ruby', 'span', 'strong', 'sub', 'sup'}
+
+
+def tokenize(text):
+    """Search tokens in text: lower-cased words, and bigrams of runs of
+    Japanese (a lone character is its own token)"""
+    text = unicodedata.normalize('NFKC', text).lower()
+    for match in TOKEN_RE.finditer(text):
+        run = match.group()
+        if match.group('japanese'):
+            if len(run) == 1:
+                yield run
+            for i in range(len(run) - 1):
+                yield run[i : i + 2]
+        else:
+            yield run
+
+
+def shard_key(token, length=1):
+    """Name of the shard holding token: the hex UTF-8 of its first
+    character, or first length characters for a part of a split shard"""
+    return token[:length].encode('utf-8').hex()
+
+
+def build_index(pages):
+    """Index the given pages.
+
+    Returns (documents, shards). documents lists [slug, title, date] for
+    each page; shards maps a shard key to the postings of each token in
+    it, {token: [[document number, score], ...]}, best score first.
+    """
+    documents = []
+    postings = {}
+    for number, page in enumerate(pages):
+        documents.append([page.slug, page.title_text, page.date.strftime('%d-%b-%y')])
+        scores = {}
+        for title in {page.title_text, page.title_reading}:
+            for token in tokenize(title):
+                scores[token] = scores.get(token, 0) + TITLE_WEIGHT
+        for text in _text(page.html):
+            for token in tokenize(text):
+                scores[token] = scores.get(token, 0) + 1
+        for token, score in scores.items():
+            postings.setdefault(token, []).append([number, score])
+
+    shards = {}
+    for token in sorted(postings):
+        hits = sorted(postings[token], key=lambda hit: (-hit[1], hit[0]))
+        shards.setdefault(shard_key(token), {})[token] = hits
+    for key, shard in list(shards.items()):
+        if _size(shard) > SHARD_BYTES:
+            parts = _split(shard)
+            shards.update(parts)
+            shards[key] = {token: hits for token, hits in shard.items() if len(token) == 1}
+            shards[key][SPLIT] = sorted(parts)
+    return documents, shards
+
+
+def _size(shard):
+    # As the app serves it
+    return len(json.dumps(shard, ensure_ascii=False, separators=(',', ':')).encode())
+
+
+def _split(shard):
+    """Parts of a shard, by the first two characters of each token"""
+    parts = {}
+    for token, hits in shard.items():
+        if len(token) > 1:
+            parts.setdefault(shard_key(token, 2), {})[token] = hits
+    return parts
+
+
+def _text(html):
+    """Plain text of the given HTML: the text, then furigana readings"""
+    parser = _TextParser()
+    parser.feed(html)
+    parser.close()
+    return ''.join(parser.text), ' '.join(parser.readings)
+
+
+class _TextParser(HTMLParser):
+    def __init__(self):
+        super().__init__()
+        self.text = []
+        self.readings = []
+        self._skip = 0
+        self._reading = False
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'rt':
+            self._reading = True
+        elif tag in ('rp', 'script', 'style'):
+            self._skip += 1
+        elif tag not in INLINE_TAGS:
+            self.text.append(' ')
+
+    def handle_endtag(self, tag):
+        if tag == 'rt':
+            self._reading = False
+        elif tag in ('rp', 'script', 'style'):
+            self._skip -= 1
+        elif tag not in INLINE_TAGS:
+            self.text.append(' ')
+
+    def handle_data(self, data):
+        if self._reading:
+            self.readings.append(data)
+        elif not self._skip:
+            self.text.append(data)
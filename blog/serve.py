@@ -0,0 +1,460 @@
+"""Serve a frozen build locally, as a static host would, for trying out
+and load-testing the deployable site.
+
+An asyncio server: connections are kept alive, files are sent with
+sendfile() (zero-copy where the platform allows), and open files and stat
+results are cached, re-checked at most once a second so a rebuild is
+picked up. GET and HEAD support conditional requests (ETag and
+Last-Modified) and single byte ranges. Files with precompressed variants
+(see blog/compress.py) are sent in the best encoding the client accepts,
+with Content-Encoding and Vary set, so nothing is compressed per request.
+
+    python -m blog.serve [directory] [--host localhost] [--port 8000]
+"""
+import argparse
+import asyncio
+import email.utils
+import mimetypes
+import os
+import time
+import urllib.parse
+from collections import OrderedDict
+from http import HTTPStatus
+
+from .compress import ENCODINGS, compressible
+
+# Seconds an idle keep-alive connection is held open
+KEEPALIVE_TIMEOUT = 15
+# Seconds a stat result is trusted
+STAT_TTL = 1.0
+MAX_OPEN_FILES = 256
+MAX_HEADERS = 100
+# Bytes per write when sendfile() isn't available
+CHUNK_SIZE = 256 * 1024
+
+# Content types that are text, for the charset parameter
+TEXT_TYPES = ('application/javascript', 'application/json', 'application/xml')
+
+
+def accepted_encodings(header):
+    """Map of content coding to quality from an Accept-Encoding header"""
+    accepted = {}
+    for item in header.split(','):
+        coding, _, params = item.partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        quality = 1.0
+        for param in params.split(';'):
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[coding] = quality
+    return accepted
+
+
+def negotiate(path, header, exists=os.path.isfile):
+    """(encoding, filename) of the variant of the file at path that the
+    client gives the highest quality, or (None, path) to send it as it is.
+    Ties go to the first in ENCODINGS, and any variant is sent rather than
+    the file as it is unless the client prefers identity outright."""
+    accepted = accepted_encodings(header)
+    best, best_quality = (None, path), 0
+    for encoding, suffix, _ in ENCODINGS:
+        quality = accepted.get(encoding, accepted.get('*', 0))
+        if quality > best_quality and exists(path + suffix):
+            best, best_quality = (encoding, path + suffix), quality
+    if accepted.get('identity', 0) > best_quality:
+        return None, path
+    return best
+
+
+def byte_range(header, size):
+    """(start, stop) of the bytes asked for by a Range header, None to send
+    the whole file, or False if the range can't be satisfied.
+
+    Only single ranges are supported; anything else gets the whole file,
+    as the spec allows.
+    """
+    unit, _, ranges = header.partition('=')
+    if unit.strip().lower() != 'bytes' or ',' in ranges:
+        return None
+    first, dash, last = ranges.strip().partition('-')
+    if not dash:
+        return None
+    try:
+        if not first:
+            # The last n bytes
+            length = int(last)
+            if length <= 0:
+                return False
+            return max(size - length, 0), size
+        start = int(first)
+        stop = int(last) + 1 if last else size
+    except ValueError:
+        return None
+    if start < 0 or stop <= start:
+        return None
+    if start >= size:
+        return False
+    return start, min(stop, size)
+
+
+def content_type(path):
+    mimetype, _ = mimetypes.guess_type(path)
+    if mimetype is None:
+        return 'application/octet-stream'
+    if mimetype.startswith('text/') or mimetype in TEXT_TYPES:
+        return mimetype + '; charset=utf-8'
+    return mimetype
+
+
+class Files:
+    """Stat results and open files, re-checked at most every STAT_TTL
+    seconds.
+
+    Open files are shared between connections, which is safe as sendfile()
+    and pread() are given an offset. Each open() is paired with a release();
+    a file that is replaced or evicted is closed once the last response
+    using it has released it.
+    """
+
+    def __init__(self):
+        # path -> (time checked, os.stat_result or None)
+        self._stats = {}
+        # path -> (file, os.stat_result of the open file)
+        self._open = OrderedDict()
+        # file -> number of responses using it
+        self._users = {}
+        # Files no longer cached, to close once released
+        self._retired = set()
+
+    def stat(self, path):
+        now = time.monotonic()
+        cached = self._stats.get(path)
+        if cached and now - cached[0] < STAT_TTL:
+            return cached[1]
+        try:
+            st = os.stat(path)
+        except OSError:
+            st = None
+        if len(self._stats) > 10000:
+            self._stats.clear()
+        self._stats[path] = (now, st)
+        return st
+
+    def isfile(self, path):
+        st = self.stat(path)
+        return st is not None and _is_regular(st)
+
+    def open(self, path):
+        """The open file at path and its stat result, to be given back with
+        release()"""
+        st = self.stat(path)
+        opened = self._open.get(path)
+        if opened and st and _same_file(opened[1], st):
+            self._open.move_to_end(path)
+        else:
+            handle = open(path, 'rb')
+            if opened:
+                # Replaced since it was opened
+                self._retire(self._open.pop(path)[0])
+            opened = (handle, os.fstat(handle.fileno()))
+            self._open[path] = opened
+            while len(self._open) > MAX_OPEN_FILES:
+                self._retire(self._open.popitem(last=False)[1][0])
+        handle = opened[0]
+        self._users[handle] = self._users.get(handle, 0) + 1
+        return opened
+
+    def release(self, handle):
+        """Finish with a file from open()"""
+        users = self._users.pop(handle) - 1
+        if users:
+            self._users[handle] = users
+        elif handle in self._retired:
+            self._retired.discard(handle)
+            handle.close()
+
+    def _retire(self, handle):
+        if handle in self._users:
+            self._retired.add(handle)
+        else:
+            handle.close()
+
+
+def _is_regular(st):
+    return (st.st_mode & 0o170000) == 0o100000
+
+
+def _same_file(a, b):
+    return (a.st_ino, a.st_size, a.st_mtime_ns) == (b.st_ino, b.st_size, b.st_mtime_ns)
+
+
+def _etag(st):
+    return '"{:x}-{:x}-{:x}"'.format(st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+def _http_date(timestamp):
+    return email.utils.formatdate(timestamp, usegmt=True)
+
+
+def _not_modified_since(header, mtime):
+    try:
+        since = email.utils.parsedate_to_datetime(header)
+    except (TypeError, ValueError):
+        return False
+    return since.timestamp() >= int(mtime)
+
+
+class _BadRequest(Exception):
+    pass
+
+
+class BuildServer:
+    """Static file server for the build in root"""
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        self.files = Files()
+
+    async def serve(self, host, port):
+        server = await asyncio.start_server(self.handle, host, port, backlog=1024)
+        async with server:
+            await server.serve_forever()
+
+    async def handle(self, reader, writer):
+        """Answer requests on one connection until it is closed"""
+        try:
+            while True:
+                try:
+                    line = await asyncio.wait_for(reader.readline(), KEEPALIVE_TIMEOUT)
+                except asyncio.TimeoutError:
+                    break
+                if not line:
+                    break
+                if not line.strip():
+                    # Stray CRLF between requests
+                    continue
+                try:
+                    request = await self._read_request(line, reader)
+                except _BadRequest:
+                    close = {'Connection': 'close'}
+                    self._send_error(writer, 'GET', HTTPStatus.BAD_REQUEST, close)
+                    await writer.drain()
+                    break
+                method, target, version, headers = request
+                keep_alive = _keep_alive(version, headers)
+                await self._respond(writer, method, target, headers, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            # ValueError is a line over the stream's limit
+            pass
+        finally:
+            writer.close()
+
+    async def _read_request(self, line, reader):
+        try:
+            method, target, version = line.decode('latin-1').split()
+        except ValueError:
+            raise _BadRequest() from None
+        if not version.startswith('HTTP/1.'):
+            raise _BadRequest()
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if not line:
+                raise asyncio.IncompleteReadError(line, None)
+            if not line.strip():
+                break
+            name, colon, value = line.decode('latin-1').partition(':')
+            if not colon or len(headers) >= MAX_HEADERS:
+                raise _BadRequest()
+            name = name.strip().lower()
+            value = value.strip()
+            headers[name] = headers[name] + ', ' + value if name in headers else value
+        if 'transfer-encoding' in headers:
+            raise _BadRequest()
+        length = headers.get('content-length', '0')
+        if not length.isdigit():
+            raise _BadRequest()
+        # Keep in step with the next request
+        await reader.readexactly(int(length))
+        return method, target, version, headers
+
+    async def _respond(self, writer, method, target, headers, keep_alive):
+        connection = {'Connection': 'keep-alive' if keep_alive else 'close'}
+        if method not in ('GET', 'HEAD'):
+            self._send_error(
+                writer,
+                method,
+                HTTPStatus.METHOD_NOT_ALLOWED,
+                dict(connection, Allow='GET, HEAD'),
+            )
+            await writer.drain()
+            return
+
+        url = urllib.parse.urlsplit(target)
+        path = self._path(urllib.parse.unquote(url.path))
+        st = self.files.stat(path) if path else None
+        if st and not _is_regular(st):
+            if not url.path.endswith('/'):
+                location = url.path + '/' + ('?' + url.query if url.query else '')
+                self._send_error(
+                    writer,
+                    method,
+                    HTTPStatus.MOVED_PERMANENTLY,
+                    dict(connection, Location=location),
+                )
+                await writer.drain()
+                return
+            path = os.path.join(path, 'index.html')
+            st = self.files.stat(path)
+        if not (st and _is_regular(st)):
+            self._send_error(writer, method, HTTPStatus.NOT_FOUND, connection)
+            await writer.drain()
+            return
+
+        response = dict(connection)
+        filename = path
+        if compressible(path):
+            encoding, filename = negotiate(
+                path, headers.get('accept-encoding', ''), self.files.isfile
+            )
+            if encoding:
+                response['Content-Encoding'] = encoding
+            # Caches must not give one client's encoding to another
+            response['Vary'] = 'Accept-Encoding'
+        try:
+            handle, fst = self.files.open(filename)
+        except OSError:
+            # Deleted since it was last looked at
+            self._send_error(writer, method, HTTPStatus.NOT_FOUND, connection)
+            await writer.drain()
+            return
+        try:
+            etag = _etag(fst)
+            # The same in every encoding
+            mtime = st.st_mtime
+            response['ETag'] = etag
+            response['Last-Modified'] = _http_date(mtime)
+            response['Accept-Ranges'] = 'bytes'
+
+            if _not_modified(headers, etag, mtime):
+                self._send_head(writer, HTTPStatus.NOT_MODIFIED, response)
+                await writer.drain()
+                return
+
+            status = HTTPStatus.OK
+            start, stop = 0, fst.st_size
+            if_range = headers.get('if-range', etag)
+            if 'range' in headers and if_range in (etag, _http_date(mtime)):
+                ranged = byte_range(headers['range'], fst.st_size)
+                if ranged is False:
+                    content_range = 'bytes */{}'.format(fst.st_size)
+                    unsatisfiable = dict(connection, **{'Content-Range': content_range})
+                    status = HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE
+                    self._send_error(writer, method, status, unsatisfiable)
+                    await writer.drain()
+                    return
+                if ranged:
+                    status = HTTPStatus.PARTIAL_CONTENT
+                    start, stop = ranged
+                    response['Content-Range'] = 'bytes {}-{}/{}'.format(
+                        start, stop - 1, fst.st_size
+                    )
+
+            response['Content-Type'] = content_type(path)
+            response['Content-Length'] = str(stop - start)
+            self._send_head(writer, status, response)
+            await writer.drain()
+            if method == 'GET' and stop > start:
+                await self._send_file(writer, handle, start, stop - start)
+        finally:
+            self.files.release(handle)
+
+    async def _send_file(self, writer, handle, offset, count):
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.sendfile(writer.transport, handle, offset, count, fallback=False)
+            return
+        except (RuntimeError, NotImplementedError):
+            # SendfileNotAvailableError is a RuntimeError, as is a closing
+            # transport; event loops without sendfile() raise
+            # NotImplementedError. Not asyncio's own fallback, which seeks
+            # the shared file.
+            if writer.transport.is_closing():
+                raise ConnectionResetError() from None
+        # Read at an offset rather than seeking, as the file is shared
+        end = offset + count
+        while offset < end:
+            data = os.pread(handle.fileno(), min(CHUNK_SIZE, end - offset), offset)
+            if not data:
+                # Truncated since it was opened
+                raise ConnectionResetError()
+            writer.write(data)
+            await writer.drain()
+            offset += len(data)
+
+    def _path(self, path):
+        """The file for a URL path, or None if it is outside the root"""
+        if not path.startswith('/') or '\0' in path:
+            return None
+        parts = [part for part in path.split('/') if part not in ('', '.')]
+        if '..' in parts:
+            return None
+        return os.path.join(self.root, *parts)
+
+    def _send_head(self, writer, status, headers):
+        lines = ['HTTP/1.1 {} {}'.format(status.value, status.phrase)]
+        lines.append('Date: ' + _http_date(time.time()))
+        lines.extend('{}: {}'.format(name, value) for name, value in headers.items())
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+
+    def _send_error(self, writer, method, status, headers):
+        body = '{} {}\n'.format(status.value, status.phrase).encode()
+        headers = dict(
+            headers, **{'Content-Type': 'text/plain', 'Content-Length': len(body)}
+        )
+        self._send_head(writer, status, headers)
+        if method != 'HEAD':
+            writer.write(body)
+
+
+def _keep_alive(version, headers):
+    connection = headers.get('connection', '').lower()
+    if version == 'HTTP/1.0':
+        return 'keep-alive' in connection
+    return 'close' not in connection
+
+
+def _not_modified(headers, etag, mtime):
+    if 'if-none-match' in headers:
+        tags = [tag.strip() for tag in headers['if-none-match'].split(',')]
+        # Weak comparison, as for GET
+        return '*' in tags or etag in tags or 'W/' + etag in tags
+    if 'if-modified-since' in headers:
+        return _not_modified_since(headers['if-modified-since'], mtime)
+    return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('directory', nargs='?', default='build')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=8000)
+    args = parser.parse_args()
+
+    print("Serving {} at http://{}:{}/".format(args.directory, args.host, args.port))
+    try:
+        asyncio.run(BuildServer(args.directory).serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
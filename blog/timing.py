@@ -0,0 +1,125 @@
+"""Per-request timing of the phases of handling a request.
+
+Code marks a phase with `with phase('name'):`. Outside a timed request
+that costs next to nothing. TimingMiddleware times each request, sends its
+phases as a Server-Timing header, and keeps the last few hundred requests
+to each route for percentiles.
+
+Each phase's time excludes the phases nested in it (Markdown rendered while
+a template is rendering counts only as markdown), and 'other' is whatever
+no phase accounts for, so the phases add up to the total.
+"""
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from jinja2 import Template
+
+# Requests kept per route
+WINDOW = 500
+PERCENTILES = (50, 95, 99)
+
+_local = threading.local()
+
+
+@contextmanager
+def phase(name):
+    """Time a phase of the current request, if any"""
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        yield
+        return
+    # Time spent in phases nested in this one
+    stack.append(0.0)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        nested = stack.pop()
+        if stack:
+            stack[-1] += elapsed
+        _local.phases[name] = _local.phases.get(name, 0.0) + elapsed - nested
+
+
+class TimedTemplate(Template):
+    """Template whose rendering is timed as the 'template' phase. Install it
+    as the Jinja environment's template_class."""
+
+    def render(self, *args, **kwargs):
+        with phase('template'):
+            return super().render(*args, **kwargs)
+
+
+class TimingMiddleware:
+    """WSGI middleware timing each request to app, whose routes are in
+    url_map"""
+
+    def __init__(self, app, url_map):
+        self.app = app
+        self.url_map = url_map
+        # route -> deque of {phase: seconds}
+        self._samples = {}
+        # Held to add to or copy _samples, as requests are threaded
+        self._lock = threading.Lock()
+
+    def __call__(self, environ, start_response):
+        route = self._route(environ)
+        start = time.perf_counter()
+        _local.stack = []
+        _local.phases = {}
+
+        def timed_start_response(status, headers, exc_info=None):
+            phases = dict(_local.phases)
+            total = time.perf_counter() - start
+            phases['other'] = max(total - sum(phases.values()), 0.0)
+            phases['total'] = total
+            with self._lock:
+                self._samples.setdefault(route, deque(maxlen=WINDOW)).append(phases)
+            headers = list(headers) + [('Server-Timing', server_timing(phases))]
+            return start_response(status, headers, exc_info)
+
+        try:
+            return self.app(environ, timed_start_response)
+        finally:
+            _local.stack = None
+
+    def summary(self):
+        """{route: {'count': n, phase: {'p50': ms, ...}}} over the requests
+        kept for each route"""
+        with self._lock:
+            routes = {route: list(samples) for route, samples in self._samples.items()}
+        summary = {}
+        for route, samples in sorted(routes.items()):
+            names = sorted(set(name for sample in samples for name in sample))
+            summary[route] = {'count': len(samples)}
+            for name in names:
+                times = sorted(sample.get(name, 0.0) * 1000 for sample in samples)
+                summary[route][name] = {
+                    'p{}'.format(p): round(percentile(times, p), 3) for p in PERCENTILES
+                }
+        return summary
+
+    def _route(self, environ):
+        try:
+            rule, _ = self.url_map.bind_to_environ(environ).match(return_rule=True)
+        except Exception:
+            # 404s, redirects and the like
+            return '(unmatched)'
+        return rule.rule
+
+
+def server_timing(phases):
+    """Server-Timing header value for {phase: seconds}"""
+    return ', '.join(
+        '{};dur={:.3f}'.format(name, seconds * 1000) for name, seconds in phases.items()
+    )
+
+
+def percentile(values, p):
+    """The p'th percentile of sorted values, by nearest rank"""
+    if not values:
+        return 0.0
+    rank = max(int(-(-len(values) * p // 100)), 1)
+    return values[rank - 1]
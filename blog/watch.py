@@ -0,0 +1,147 @@
+"""Watch a directory tree for changed files.
+
+Watchers run in a daemon thread and call callback(path) for each file with
+one of the given suffixes (Markdown by default) that was created, modified,
+moved or deleted. callback(None) means events may have been lost and the
+caller should rescan everything.
+"""
+import ctypes
+import ctypes.util
+import os
+import struct
+import threading
+import time
+
+# From <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (
+    IN_MODIFY
+    | IN_ATTRIB
+    | IN_CLOSE_WRITE
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+    | IN_DELETE_SELF
+)
+
+EVENT_HEADER = struct.Struct('iIII')
+
+
+def watch(directory, callback, suffixes=('.md',)):
+    """Start watching directory, using inotify if available, else polling"""
+    try:
+        watcher = InotifyWatcher(directory, callback, suffixes)
+    except OSError:
+        watcher = PollingWatcher(directory, callback, suffixes)
+    watcher.start()
+    return watcher
+
+
+class InotifyWatcher(threading.Thread):
+    """Linux inotify watcher, via ctypes so no extra dependency is needed"""
+
+    def __init__(self, directory, callback, suffixes=('.md',)):
+        super().__init__(name='inotify-watcher', daemon=True)
+        self.directory = directory
+        self.callback = callback
+        self.suffixes = tuple(suffixes)
+
+        libc_name = ctypes.util.find_library('c')
+        libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(libc, 'inotify_init1'):
+            raise OSError("inotify is not supported on this platform")
+        self._libc = libc
+        self._fd = libc.inotify_init1(IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._dirs = {}
+        self._add_tree(directory)
+
+    def run(self):
+        while True:
+            try:
+                data = os.read(self._fd, 64 * 1024)
+            except OSError:
+                return
+            self._dispatch(data)
+
+    def _dispatch(self, data):
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+
+            if mask & IN_Q_OVERFLOW:
+                self.callback(None)
+                continue
+            if mask & (IN_IGNORED | IN_DELETE_SELF):
+                self._dirs.pop(wd, None)
+                continue
+
+            directory = self._dirs.get(wd)
+            if directory is None:
+                continue
+            path = os.path.join(directory, os.fsdecode(name))
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    self._add_tree(path)
+                # Whole subtrees came or went; let the caller rescan
+                self.callback(None)
+            elif path.endswith(self.suffixes):
+                self.callback(path)
+
+    def _add_tree(self, directory):
+        for subdir, _, _ in os.walk(directory):
+            wd = self._libc.inotify_add_watch(self._fd, os.fsencode(subdir), WATCH_MASK)
+            if wd < 0:
+                raise OSError(ctypes.get_errno(), "inotify_add_watch failed: " + subdir)
+            self._dirs[wd] = subdir
+
+
+class PollingWatcher(threading.Thread):
+    """Portable fallback: rescan the tree every interval seconds"""
+
+    def __init__(self, directory, callback, suffixes=('.md',), interval=1.0):
+        super().__init__(name='polling-watcher', daemon=True)
+        self.directory = directory
+        self.callback = callback
+        self.suffixes = tuple(suffixes)
+        self.interval = interval
+        self._seen = self._snapshot()
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            seen = self._snapshot()
+            for path in seen.keys() | self._seen.keys():
+                if seen.get(path) != self._seen.get(path):
+                    self.callback(path)
+            self._seen = seen
+
+    def _snapshot(self):
+        snapshot = {}
+        for subdir, _, filenames in os.walk(self.directory):
+            for fn in filenames:
+                if fn.endswith(self.suffixes):
+                    path = os.path.join(subdir, fn)
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    snapshot[path] = (st.st_mtime_ns, st.st_size)
+        return snapshot
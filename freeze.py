@@ -1,8 +1,365 @@
 #!/usr/bin/env python
-from flask_frozen import Freezer
+"""Freeze the blog into static files.
 
-from app import app
+URLs are enumerated up front from the app's routes and the page index.
+A manifest records a digest of each output's inputs (source files,
+templates and code, and the pages it lists), so only outputs whose inputs
+changed are rebuilt, and outputs that no longer exist are deleted. The
+work is sharded across a pool of worker processes, each with its own app
+and page index.
+
+Text outputs (HTML, JSON, XML, CSS and JS) are also written compressed
+alongside, for servers that can send precompressed files; see
+blog/compress.py. Resized copies of images are made first, across the same
+number of processes; see blog/images.py. Last, CSS bundles are cut down to
+the rules the pages use, and each page gets the CSS for its first screen
+inlined; see blog/purge.py.
+"""
+import argparse
+import functools
+import glob
+import hashlib
+import json
+import os
+import sys
+from multiprocessing import Pool
+from unicodedata import normalize
+
+from flask_frozen import Freezer, walk_directory
+
+from app import (
+    app,
+    assets,
+    cursors,
+    images,
+    inject_pages,
+    pages,
+    paginate,
+    search_index,
+)
+from blog.cache import CACHE_DIR
+from blog.compress import variants, write_variants
+from blog.purge import optimise
+
+MANIFEST = os.path.join(CACHE_DIR, 'freeze-manifest.json')
+
+# Code and templates; a change to any of these rebuilds everything
+SOURCES = ('app.py', 'blog/*.py', 'mdx_*.py', 'slugify.py', 'templates/**/*.html')
 
 freezer = Freezer(app)
+
+
+@freezer.register_generator
+def page():
+    for p in pages.all():
+        yield {'slug': p.slug}
+
+
+@freezer.register_generator
+def index():
+    for after in cursors(pages.all()):
+        yield {'after': after}
+
+
+@freezer.register_generator
+def index_json():
+    return index()
+
+
+@freezer.register_generator
+def tag():
+    for name in pages.tag_counts():
+        yield {'tag': name}
+        for after in cursors(pages.with_tag(name)):
+            yield {'tag': name, 'after': after}
+
+
+@freezer.register_generator
+def tag_json():
+    for values in tag():
+        if 'after' in values:
+            yield values
+
+
+@freezer.register_generator
+def category():
+    for name in pages.category_counts():
+        yield {'category': name}
+        for after in cursors(pages.with_category(name)):
+            yield {'category': name, 'after': after}
+
+
+@freezer.register_generator
+def category_json():
+    for values in category():
+        if 'after' in values:
+            yield values
+
+
+@freezer.register_generator
+def search_shard():
+    _, shards = search_index()
+    for key in shards:
+        yield {'key': key}
+
+
+@freezer.register_generator
+def asset():
+    for bundle in assets.bundles():
+        yield {'name': bundle.name}
+
+
+@freezer.register_generator
+def image():
+    for name in images.derivatives():
+        yield {'name': name}
+
+
+def _source_file(values):
+    st = os.stat(pages[values['slug']].path)
+    return [st.st_size, st.st_mtime_ns]
+
+
+def _static_file(values):
+    st = os.stat(os.path.join(app.static_folder, values['filename']))
+    return [st.st_size, st.st_mtime_ns]
+
+
+def _listing(pagelist):
+    return [
+        [p.slug, p.title, p.date.isoformat(), p.category, sorted(p.tags), p.summary]
+        for p in pagelist
+    ]
+
+
+def _paginated(query, values):
+    """The pages listed at one cursor position, and the next cursor"""
+    listed, after = paginate(query, values.get('after'))
+    return [_listing(listed), after]
+
+
+def _with_tag(values):
+    return functools.partial(pages.with_tag, values['tag'])
+
+
+def _with_category(values):
+    return functools.partial(pages.with_category, values['category'].title())
+
+
+# Inputs of each endpoint's output, other than the site-wide ones.
+# Endpoints not listed here are rebuilt every time.
+DEPENDENCIES = {
+    'static': _static_file,
+    # Bundles and resized images are named by their content
+    'asset': lambda values: [],
+    'image': lambda values: [],
+    'page': _source_file,
+    'about': lambda values: [],
+    'index': lambda values: _paginated(pages.all, values),
+    'index_json': lambda values: _paginated(pages.all, values),
+    'featured': lambda values: _listing(pages.featured()),
+    'tag': lambda values: _paginated(_with_tag(values), values),
+    'tag_json': lambda values: _paginated(_with_tag(values), values),
+    'category': lambda values: _paginated(_with_category(values), values),
+    'category_json': lambda values: _paginated(_with_category(values), values),
+    'search': lambda values: [],
+    'search_documents': lambda values: search_index()[0],
+    'search_shard': lambda values: search_index()[1][values['key']],
+}
+
+
+def site_inputs():
+    """Digest of the inputs shared by every output: code, templates, the
+    asset bundles they link to, the images articles may show, and the
+    context (sidebar tags and categories) supplied to every template"""
+    digest = hashlib.sha256()
+    for pattern in SOURCES:
+        for path in sorted(glob.glob(pattern, recursive=True)):
+            digest.update(path.encode())
+            with open(path, 'rb') as handle:
+                digest.update(handle.read())
+    digest.update(json.dumps([bundle.name for bundle in assets.bundles()]).encode())
+    digest.update(json.dumps(images.sources()).encode())
+    digest.update(json.dumps(inject_pages(), sort_keys=True).encode())
+    return digest.hexdigest()
+
+
+def url_inputs(url, site):
+    """Digest of everything the output for url depends on, or None if we
+    can't tell (so it must always be rebuilt)"""
+    endpoint, values = app.url_map.bind('localhost').match(url)
+    dependencies = DEPENDENCIES.get(endpoint)
+    if dependencies is None:
+        return None
+    data = [endpoint, values, dependencies(values)]
+    if endpoint not in ('static', 'asset', 'image'):
+        # Static files, bundles and images don't come from templates
+        data.append(site)
+    return hashlib.sha256(json.dumps(data, sort_keys=True).encode()).hexdigest()
+
+
+def freeze(jobs, full=False):
+    """Build every URL whose inputs changed since the last freeze, and
+    delete outputs for URLs that have gone. Returns the URLs built."""
+    root = freezer.root
+    manifest = _load_manifest()
+    if manifest.get('root') != root:
+        full = True
+    previous = {} if full else manifest['outputs']
+
+    site = site_inputs()
+    outputs = {}
+    todo = []
+    for url in dict.fromkeys(freezer.all_urls()):
+        filename = os.path.join(root, *freezer.urlpath_to_filepath(url).split('/'))
+        outputs[url] = [url_inputs(url, site), filename]
+        if (
+            outputs[url][0] is None
+            or previous.get(url) != outputs[url]
+            or not all(os.path.isfile(fn) for fn in _files(filename))
+        ):
+            todo.append(url)
+            # Workers would race to create shared parent directories
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+
+    images.prepare(jobs)
+    _build(todo, jobs)
+    purged, css = _purge_css(outputs, todo, None if full else manifest.get('css'))
+
+    if full:
+        # We don't know what an earlier build left behind, so clean up
+        # everything else, as Freezer.freeze() does
+        ignore = app.config['FREEZER_DESTINATION_IGNORE']
+        existing = set(
+            normalize('NFC', os.path.join(root, *name.split('/')))
+            for name in walk_directory(root, ignore=ignore)
+        )
+        live = set(
+            normalize('NFC', fn)
+            for filename in [filename for _, filename in outputs.values()] + purged
+            for fn in _files(filename)
+        )
+        stale = existing - live
+    else:
+        stale = set(
+            fn
+            for url, (_, filename) in previous.items()
+            if url not in outputs
+            for fn in _files(filename)
+        )
+        stale.update(
+            fn
+            for filename in manifest.get('purged', [])
+            if filename not in purged
+            for fn in _files(filename)
+        )
+    for filename in stale:
+        _remove(filename)
+
+    _save_manifest({'root': root, 'outputs': outputs, 'purged': purged, 'css': css})
+    return todo
+
+
+def _purge_css(outputs, todo, previous):
+    """Cut the CSS bundles down to what the pages use, and inline each
+    page's critical CSS. Only the pages in todo are read, unless the
+    purged CSS changed since previous, as returned last time. Returns the
+    purged bundles' files, and what to pass as previous next time."""
+    adapter = app.url_map.bind('localhost')
+    html_files = [
+        filename for _, filename in outputs.values() if filename.endswith('.html')
+    ]
+    stylesheets = {
+        url: filename
+        for url, (_, filename) in outputs.items()
+        if filename.endswith('.css') and adapter.match(url)[0] == 'asset'
+    }
+    scripts = []
+    for filename in assets.files():
+        # Third-party scripts would keep a rule for every word in them
+        if filename.endswith('.js') and 'vendor' not in filename.split(os.sep):
+            with open(filename, encoding='utf-8') as handle:
+                scripts.append(handle.read())
+    changed = [outputs[url][1] for url in todo]
+    return optimise(html_files, stylesheets, scripts, changed, previous)
+
+
+def _files(filename):
+    """The files written for an output"""
+    return [filename] + variants(filename)
+
+
+def _build(urls, jobs):
+    if jobs > 1 and len(urls) > 1:
+        shards = [urls[i::jobs * 4] for i in range(jobs * 4)]
+        with Pool(jobs, initializer=_init_worker) as pool:
+            for _ in pool.imap_unordered(_build_shard, shards):
+                pass
+    else:
+        _init_worker()
+        _build_shard(urls)
+
+
+def _init_worker():
+    # URLs are already known, so there's no need to record url_for calls
+    freezer.log_url_for = False
+
+
+def _build_shard(urls):
+    for url in urls:
+        # _build_one is Frozen-Flask's fetch-and-write step, as used by freeze()
+        write_variants(freezer._build_one(url))
+
+
+def _remove(filename):
+    try:
+        os.remove(filename)
+    except FileNotFoundError:
+        return
+    parent = os.path.dirname(filename)
+    if not os.listdir(parent):
+        os.removedirs(parent)
+
+
+def _load_manifest():
+    try:
+        with open(MANIFEST) as handle:
+            return json.load(handle)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_manifest(manifest):
+    os.makedirs(os.path.dirname(MANIFEST), exist_ok=True)
+    with open(MANIFEST + '.tmp', 'w') as handle:
+        json.dump(manifest, handle)
+    os.replace(MANIFEST + '.tmp', MANIFEST)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        '-j',
+        '--jobs',
+        type=int,
+        default=os.cpu_count() or 1,
+        help="number of worker processes (default: one per CPU)",
+    )
+    parser.add_argument(
+        '--full',
+        action='store_true',
+        help="ignore the manifest and rebuild everything",
+    )
+    args = parser.parse_args()
+    if images.need_pillow():
+        print(
+            "Warning: Pillow isn't installed, so images get no width, height or "
+            "resized copies (pip install -r requirements.txt)",
+            file=sys.stderr,
+        )
+    built = freeze(args.jobs, full=args.full)
+    print("Froze {} URLs".format(len(built)))
+
+
 if __name__ == '__main__':
-    freezer.freeze()
+    main()
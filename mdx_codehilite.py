@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+
+"""
+mdx_codehilite - codehilite, with highlighted code cached
+
+Drop-in replacement for the codehilite extension (taking the same
+options), which keeps each highlighted block in a disk cache shared by
+every page, process and build. Fenced code blocks are cached too if
+fenced_code is loaded as mdx_codehilite:FencedCodeExtension instead.
+Re-rendering an article after editing its prose, or a block that also
+appears elsewhere, costs a file read rather than a lexing and formatting
+pass.
+
+Blocks are cached by their source and every option that affects the
+output, along with the Markdown and Pygments versions.
+"""
+import json
+import os
+
+import markdown
+import pygments
+from markdown.extensions import codehilite, fenced_code
+from markdown.extensions.attr_list import AttrListExtension, get_attrs
+
+from blog.cache import CACHE_DIR, DiskCache
+
+_cache = DiskCache(os.path.join(CACHE_DIR, 'hilite'), max_bytes=16 * 1024 * 1024)
+
+
+class CachedCodeHilite(codehilite.CodeHilite):
+    def hilite(self, shebang=True):
+        # Everything hilite() reads: src, lang and the formatter options
+        key = json.dumps(
+            [markdown.__version__, pygments.__version__, shebang, vars(self)],
+            sort_keys=True,
+            default=repr,
+        )
+        html = _cache.get(key)
+        if html is None:
+            html = super().hilite(shebang)
+            _cache.set(key, html)
+        return html
+
+
+class HiliteTreeprocessor(codehilite.HiliteTreeprocessor):
+    # As codehilite's, highlighting with CachedCodeHilite
+    def run(self, root):
+        for block in root.iter('pre'):
+            if len(block) == 1 and block[0].tag == 'code':
+                code = CachedCodeHilite(
+                    self.code_unescape(block[0].text),
+                    tab_length=self.md.tab_length,
+                    style=self.config.pop('pygments_style', 'default'),
+                    **self.config
+                )
+                placeholder = self.md.htmlStash.store(code.hilite())
+                # Clear codeblock in etree instance
+                block.clear()
+                # Change to p element which will later
+                # be removed when inserting raw html
+                block.tag = 'p'
+                block.text = placeholder
+
+
+class FencedBlockPreprocessor(fenced_code.FencedBlockPreprocessor):
+    # As fenced_code's (from Markdown 3.3), highlighting with CachedCodeHilite
+    def run(self, lines):
+        # Check for dependent extensions
+        if not self.checked_for_deps:
+            for ext in self.md.registeredExtensions:
+                if isinstance(ext, codehilite.CodeHiliteExtension):
+                    self.codehilite_conf = ext.getConfigs()
+                if isinstance(ext, AttrListExtension):
+                    self.use_attr_list = True
+            self.checked_for_deps = True
+
+        text = "\n".join(lines)
+        while True:
+            m = self.FENCED_BLOCK_RE.search(text)
+            if not m:
+                break
+            lang, id, classes, config = None, '', [], {}
+            if m.group('attrs'):
+                id, classes, config = self.handle_attrs(get_attrs(m.group('attrs')))
+                if len(classes):
+                    lang = classes.pop(0)
+            else:
+                if m.group('lang'):
+                    lang = m.group('lang')
+                if m.group('hl_lines'):
+                    # Support hl_lines outside of attrs for backward-compatibility
+                    config['hl_lines'] = codehilite.parse_hl_lines(m.group('hl_lines'))
+
+            if (
+                self.codehilite_conf
+                and self.codehilite_conf['use_pygments']
+                and config.get('use_pygments', True)
+            ):
+                local_config = self.codehilite_conf.copy()
+                local_config.update(config)
+                # Pygments may append a suffix to the last class
+                if classes:
+                    local_config['css_class'] = '{} {}'.format(
+                        ' '.join(classes), local_config['css_class']
+                    )
+                highliter = CachedCodeHilite(
+                    m.group('code'),
+                    lang=lang,
+                    style=local_config.pop('pygments_style', 'default'),
+                    **local_config
+                )
+                code = highliter.hilite(shebang=False)
+            else:
+                id_attr = lang_attr = class_attr = kv_pairs = ''
+                if lang:
+                    prefix = self.config.get('lang_prefix', 'language-')
+                    lang_attr = ' class="{}{}"'.format(prefix, lang)
+                if classes:
+                    class_attr = ' class="{}"'.format(' '.join(classes))
+                if id:
+                    id_attr = ' id="{}"'.format(id)
+                if self.use_attr_list and config and not config.get('use_pygments', False):
+                    kv_pairs = ' ' + ' '.join(
+                        '{k}="{v}"'.format(k=k, v=v)
+                        for k, v in config.items()
+                        if k != 'use_pygments'
+                    )
+                code = '<pre{id}{cls}><code{lang}{kv}>{code}</code></pre>'.format(
+                    id=id_attr,
+                    cls=class_attr,
+                    lang=lang_attr,
+                    kv=kv_pairs,
+                    code=self._escape(m.group('code')),
+                )
+
+            placeholder = self.md.htmlStash.store(code)
+            text = '{}\n{}\n{}'.format(text[: m.start()], placeholder, text[m.end() :])
+        return text.split("\n")
+
+
+class CodeHiliteExtension(codehilite.CodeHiliteExtension):
+    def extendMarkdown(self, md):
+        super().extendMarkdown(md)
+        hiliter = HiliteTreeprocessor(md)
+        hiliter.config = self.getConfigs()
+        md.treeprocessors.register(hiliter, 'hilite', 30)
+
+
+class FencedCodeExtension(fenced_code.FencedCodeExtension):
+    def extendMarkdown(self, md):
+        super().extendMarkdown(md)
+        md.preprocessors.register(
+            FencedBlockPreprocessor(md, self.getConfigs()), 'fenced_code_block', 25
+        )
+
+
+def makeExtension(**kwargs):
+    return CodeHiliteExtension(**kwargs)
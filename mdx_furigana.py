@@ -20,14 +20,19 @@ Manually specify how to assign readings to kanji:
 
 """
 
+from functools import lru_cache
+from html import escape as html_escape
+
 import regex
 import markdown
+import markdown.inlinepatterns
 import markdown.postprocessors
 
 FURIGANA_RE = regex.compile(r'''
     (?|
-        # [飛び越える]{とびこえる} syntax
-        (?: \[ (?P<kanji>.+?) \] \{ (?P<furigana>.+?) \} )
+        # [飛び越える]{とびこえる} syntax; no brackets inside, so a link or
+        # reference earlier in the text can't be taken for the start
+        (?: \[ (?P<kanji>[^\[\]\n]+?) \] \{ (?P<furigana>.+?) \} )
       |
         # 漢字{かんじ} syntax
         (?: (?P<kanji>\p{Han}[\p{Hiragana}\p{Han}]*?)
@@ -39,22 +44,101 @@ FURIGANA_RE = regex.compile(r'''
     )
 ''', flags=regex.VERBOSE | regex.DOTALL)
 
-class FuriganaPostprocessor(markdown.postprocessors.Postprocessor):
-    def run(self, text):
-        def handleMatch(m):
-            kanji = m.group('kanji')
-            furigana = m.group('furigana')
-            if regex.fullmatch('[HL]+', furigana, flags=regex.I):
-                html = make_pitch_html(kanji, furigana)
-            elif '・' in furigana:
-                # Manually specified reading
-                html = make_ruby_html_fixed(kanji, furigana)
-            else:
-                html = make_ruby_html(kanji, furigana)
+# Japanese text between furigana, which no other inline pattern touches
+PLAIN_JAPANESE = r'[\p{Han}\p{Hiragana}\p{Katakana}ー々、。・「」『』（）！？　]'
+
+# A run of furigana separated only by plain Japanese: it can be rendered in
+# one go, rather than handing each piece of furigana back to markdown.
+# The lazy gaps make each piece start where FURIGANA_RE would find it.
+FURIGANA_RUN_RE = regex.compile(
+    r'(?:{0})(?:{1}*?(?:{0}))*'.format(FURIGANA_RE.pattern, PLAIN_JAPANESE),
+    flags=regex.VERBOSE | regex.DOTALL,
+)
+
+PITCH_RE = regex.compile(r'[HL]+', flags=regex.I)
+HAN_RE = regex.compile(r'\p{Han}')
+HAN_RUN_RE = regex.compile(r'\p{Han}+')
+
+
+def furigana_html(kanji, furigana):
+    """HTML for one piece of furigana markup"""
+    if PITCH_RE.fullmatch(furigana):
+        return make_pitch_html(kanji, furigana)
+    elif '・' in furigana:
+        # Manually specified reading
+        return make_ruby_html_fixed(kanji, furigana)
+    else:
+        return make_ruby_html(kanji, furigana)
+
+
+def render_furigana(text):
+    """Replace all furigana markup in text (which may be HTML) with HTML"""
+    return FURIGANA_RE.sub(lambda m: furigana_html(m.group('kanji'), m.group('furigana')), text)
+
+
+class _BracedSearch:
+    """A compiled pattern whose matches all have a { in them, which doesn't
+    search text without one (most of the text in most articles)"""
+
+    def __init__(self, pattern):
+        self._pattern = pattern
+        self.pattern = pattern.pattern
+
+    def search(self, string, pos=0):
+        if string.find('{', pos) < 0:
+            return None
+        return self._pattern.search(string, pos)
+
+    def match(self, string, pos=0):
+        if string.find('{', pos) < 0:
+            return None
+        return self._pattern.match(string, pos)
+
+    def finditer(self, string, pos=0):
+        if string.find('{', pos) < 0:
+            return iter(())
+        return self._pattern.finditer(string, pos)
+
+
+class FuriganaInlineProcessor(markdown.inlinepatterns.InlineProcessor):
+    """Furigana in text, found as the document is parsed, so code and
+    attributes are left alone and only text is searched. Used with the
+    inline option."""
+
+    def __init__(self, md):
+        # Not super().__init__(), which compiles the pattern with re; it
+        # needs regex for \p{...} and (?|...)
+        self.pattern = FURIGANA_RUN_RE.pattern
+        self.compiled_re = _BracedSearch(FURIGANA_RUN_RE)
+        self.safe_mode = False
+        self.md = md
+
+    def handleMatch(self, m, data):
+        # regex keeps the groups of every piece in the run, so the run
+        # needn't be searched again to find them
+        html = []
+        pos = m.start(0)
+        for (start, _), (_, end), kanji, furigana in zip(
+            m.spans('kanji'), m.spans('furigana'), m.captures('kanji'), m.captures('furigana')
+        ):
+            if start > pos and data[start - 1] == '[':
+                start -= 1
+            html.append(html_escape(data[pos:start], quote=False))
+            html.append(
+                furigana_html(html_escape(kanji, quote=False), html_escape(furigana, quote=False))
+            )
+            # Past the closing }
+            pos = end + 1
+        return self.md.htmlStash.store(''.join(html)), m.start(0), m.end(0)
 
-            return html
 
-        return regex.sub(FURIGANA_RE, handleMatch, text)
+class FuriganaPostprocessor(markdown.postprocessors.Postprocessor):
+    """Furigana markup anywhere in the output HTML, code and attributes
+    included. The default, as FuriganaInlineProcessor is no faster: the
+    stash costs as much as the scan it saves (see bench/run.py)."""
+
+    def run(self, text):
+        return render_furigana(text)
 
 
 def make_pitch_html(kanji, pitch):
@@ -84,13 +168,14 @@ def make_ruby_html_fixed(kanji, furigana):
     furigana = furigana.split('・')
     def fillSlot(m):
         return '<ruby>{}<rt>{}</rt></ruby>'.format(m.group(0), furigana.pop(0))
-    return regex.sub(r'\p{Han}', fillSlot, kanji)
+    return HAN_RE.sub(fillSlot, kanji)
 
 def make_ruby_html(kanji, furigana):
-    # Replace kanji with placeholders
-    pattern = regex.sub(r'\p{Han}+', "(.+)", kanji)
+    # Replace kanji with placeholders, matching the kana between literally
+    kana = HAN_RUN_RE.split(kanji)
+    pattern = _reading_re('(.+)'.join(regex.escape(text) for text in kana))
     # Substitute in the reading to fill those placeholders
-    match = regex.match(pattern, furigana)
+    match = pattern.match(furigana)
     if match:
         furigana_grouped = list(match.groups())
         def buildTag(m):
@@ -101,15 +186,30 @@ def make_ruby_html(kanji, furigana):
             else:
                 return '<ruby>{}<rt>{}</rt></ruby>'.format(this_kanji, this_furigana)
 
-        output = regex.sub(r'(\p{Han}+)', buildTag, kanji)
+        output = HAN_RUN_RE.sub(buildTag, kanji)
     else:
         # Fall back to full tag
         output = '<ruby>' + kanji + '<rt>' + furigana + '</rt></ruby>'
     return output
 
+@lru_cache(maxsize=1024)
+def _reading_re(pattern):
+    # There are too many of these for regex's own small cache
+    return regex.compile(pattern)
+
 class FuriganaExtension(markdown.extensions.Extension):
+    def __init__(self, **kwargs):
+        self.config = {
+            'inline': [False, "Find furigana as the document is parsed, not in the output"],
+        }
+        super().__init__(**kwargs)
+
     def extendMarkdown(self, md):
-        md.postprocessors.register(FuriganaPostprocessor(), 'furigana-postproc', 0)
+        if self.getConfig('inline'):
+            # After backticks and escapes, before links claim [...]
+            md.inlinePatterns.register(FuriganaInlineProcessor(md), 'furigana', 175)
+        else:
+            md.postprocessors.register(FuriganaPostprocessor(), 'furigana-postproc', 0)
 
 def makeExtension(**kwargs):
     return FuriganaExtension(**kwargs)
@@ -33,20 +33,44 @@ TODO:
 
 """
 
-from markdown import Extension, Markdown
+from markdown import Extension
 from markdown.blockprocessors import BlockProcessor
 from markdown.util import etree, AtomicString
+from functools import lru_cache
 from itertools import takewhile
 import regex
 import json
 
+from mdx_furigana import render_furigana
+
+ANNOTATION_RE = regex.compile(r'''
+        ^//(?P<num>\d+)(?P<highlight>\!)?\s+
+        (?P<word>.*?)(?: :(?P<display_word>.*?) )?\s+
+        (?P<detail>.*?)$
+''', regex.VERBOSE | regex.M | regex.S)
+
+BRACKET_FURIGANA_RE = regex.compile(r'\[(.*?)\]\{.*?\}')
+FURIGANA_RE = regex.compile(r'\{.*?\}')
+
+
+@lru_cache(maxsize=1024)
+def _word_re(word):
+    """Pattern for word in a sentence, with any furigana after it"""
+    # Matches as mdx_furigana does
+    w = regex.escape(word)
+    return regex.compile(r'''(
+            (?: \[ ''' + w + r''' \] \{ (?P<furigana>.+?) \} )
+        |
+            ''' + w + r'''\{ (?P<furigana>.*?) \}
+        |
+            ''' + w + '''
+        )
+    ''', flags=regex.VERBOSE | regex.DOTALL)
+
+
 class ReibunProcessor(BlockProcessor):
     """ Process definition lists"""
 
-    def __init__(self, parser):
-        self._markdown_instance = Markdown(extensions=())
-        super().__init__(parser)
-
     def test(self, _parent, block):
         return block.startswith('//')
 
@@ -73,12 +97,7 @@ class ReibunProcessor(BlockProcessor):
         en = self._build_sentence(div, '///', 'en', block)
 
         # Now handle annotations, if given
-        for annotation in regex.finditer(r'''
-                ^//(?P<num>\d+)(?P<highlight>\!)?\s+
-                (?P<word>.*?)(?: :(?P<display_word>.*?) )?\s+
-                (?P<detail>.*?)$
-        ''', block, regex.VERBOSE | regex.M | regex.S):
-            jp = self._inject_annotation(jp, annotation)
+        self._inject_annotations(jp, list(ANNOTATION_RE.finditer(block)))
 
         # Remove English sentence if empty
         if len(en) == 0 and len(en.text or '') == 0:
@@ -108,67 +127,73 @@ class ReibunProcessor(BlockProcessor):
 
         return p
 
-    def _inject_annotation(self, tree, annotation):
-        """Inject the annotation into the sentence etree as a <span>"""
-        word = self._strip_furigana(annotation['word'])
-        # Find the node corresponding to the last annotation injected
-        # Return as an index on tree
-        start = self._find_last_annotation(tree)
-        for index in range(start, len(tree)):
-            node = tree[index] if index >= 0 else tree
-            text = node.tail if index >= 0 else node.text
-            pos = text.find(word)
-            if pos == -1:
-                continue  # no match on this node
-            # Match any furigana after the word
-            # stolen from mdx_furigana for now
-            w = regex.escape(word)
-            rgx = regex.compile(r'''('
-                    (?: \[ ''' + w + r''' \] \{ (?P<furigana>.+?) \} )
-                |
-                    ''' + w + r'''\{ (?P<furigana>.*?) \}
-                |
-                    ''' + w + '''
-                )
-            ''', flags=regex.VERBOSE | regex.DOTALL)
-            pos = rgx.search(text)
-            assert pos
-            furigana = pos.group('furigana')
-
-            before, after = text[:pos.start(0)], text[pos.end(0):]
-            if node == tree:
-                node.text = before
+    def _inject_annotations(self, tree, annotations):
+        """Wrap each annotated word of the sentence etree in a <span>.
+
+        Annotations are in sentence order, so each is looked for after the
+        one before, in one pass over the sentence's text: tree.text, then
+        the tail of each <br>.
+        """
+        segments = [tree] + list(tree)
+        texts = [tree.text] + [child.tail for child in tree]
+        found = [[] for _ in segments]
+        index, offset = 0, 0
+        for annotation in annotations:
+            word = self._strip_furigana(annotation['word'])
+            pattern = _word_re(word)
+            while index < len(texts):
+                match = pattern.search(texts[index], offset)
+                if match:
+                    break
+                index, offset = index + 1, 0
             else:
-                node.tail = before
-
-            classes = ['an']
-            if annotation['highlight']:
-                classes.append('an-highlight')
-
-            span = etree.Element('span', {
-                'class': ' '.join(classes),
-                'title': annotation['detail'],
-                'data-annotation': self._build_annotation_html(annotation, furigana),
-            })
-            if furigana:
-                span.text = '[' + word + ']{' + furigana + '}'
+                raise Exception("unable to find {!r} injection point".format(annotation['word']))
+            found[index].append((match, word, annotation))
+            offset = match.end(0)
+
+        children = []
+        for segment, text, matches in zip(segments, texts, found):
+            head, spans, pos = text, [], 0
+            for match, word, annotation in matches:
+                before = text[pos:match.start(0)]
+                if spans:
+                    spans[-1].tail = before
+                else:
+                    head = before
+                spans.append(self._annotation_span(annotation, word, match.group('furigana')))
+                pos = match.end(0)
+            if spans:
+                spans[-1].tail = text[pos:]
+            if segment is tree:
+                tree.text = head
             else:
-                span.text = word
-            span.tail = after
-            tree.insert(index + 1, span)
-            return tree
-        raise Exception("unable to find {!r} injection point".format(annotation['word']))
+                segment.tail = head
+                children.append(segment)
+            children.extend(spans)
+        tree[:] = children
+        return tree
+
+    def _annotation_span(self, annotation, word, furigana):
+        classes = ['an']
+        if annotation['highlight']:
+            classes.append('an-highlight')
+
+        span = etree.Element('span', {
+            'class': ' '.join(classes),
+            'title': self._strip_furigana(annotation['detail']),
+            'data-annotation': self._build_annotation_html(annotation, furigana),
+        })
+        if furigana:
+            span.text = '[' + word + ']{' + furigana + '}'
+        else:
+            span.text = word
+        return span
 
     def _markdown(self, markup, strip_p=False):
         """Generate HTML from Markdown. Mostly used for furigana."""
         # Disabling as this is a horrible hack
         return markup
 
-        html = self._markdown_instance.convert(markup)
-        if strip_p:
-            html = regex.fullmatch('<p>(.*?)</p>', html).group(1)
-        return html
-
     def _build_ruby(self, word):
         """Convert markdown ruby markup such as 平仮名{ひりがな} to
            HTML and return it"""
@@ -216,21 +241,14 @@ class ReibunProcessor(BlockProcessor):
         if detail and len(detail):
             # Add regular information
             html += self._markdown(detail)
-        return html
-
-    def _find_last_annotation(self, tree):
-        matching = [index for index in range(len(tree))
-                        if tree[index].tag == 'span'
-                        and 'an' in tree[index].get('class', '').split()]
-        if matching:
-            return matching[-1]
-        else:
-            return -1
+        # Rendered here so it is escaped with the rest of the attribute; and
+        # attributes are out of reach of mdx_furigana's inline option
+        return render_furigana(html)
 
     def _strip_furigana(self, word):
         """Remove []{} and {} furigana markup"""
-        word = regex.sub(r'\[(.*?)\]\{.*?\}', r'\1', word)
-        word = regex.sub(r'\{.*?\}', r'', word)
+        word = BRACKET_FURIGANA_RE.sub(r'\1', word)
+        word = FURIGANA_RE.sub(r'', word)
         return word
 
 
@@ -27,19 +27,27 @@ import markdown
 import re
 import unicodedata
 import markdown.inlinepatterns
+from functools import lru_cache
 from markdown.util import etree
 
 UNICHAR_RE = r'u\{\s*(.*?)([#\'+!]*)\s*\}'
+HEX_RE = re.compile(r'^(?:U\+)?([0-9A-F]{2,})$', re.I)
 
-class UnicharPattern(markdown.inlinepatterns.Pattern):
-    def handleMatch(self, m):
-        char, flags = m.group(2,3)
-        flags = self.parseFlags(flags)
-        if "!" in flags and '#' in flags:
-            del flags['#']
-        char = self.parseChar(char)
-        name = self.getName(char)
-        code = "%04X" % ord(char)
+# Names for characters our unicodedata may not know, by codepoint
+FALLBACK_NAMES = {
+    0x1f3e9: "LOVE HOTEL",
+    0x1f4a9: "PILE OF POO",
+}
+FALLBACK_NAMES.update(
+    (0x1f1e6 + n, "REGIONAL INDICATOR SYMBOL LETTER '" + chr(ord('A') + n) + "'")
+    for n in range(26)
+)
+FALLBACK_CODES = {name: codepoint for codepoint, name in FALLBACK_NAMES.items()}
+
+
+class UnicharInlineProcessor(markdown.inlinepatterns.InlineProcessor):
+    def handleMatch(self, m, data):
+        name, code, text, info = render_char(m.group(1), m.group(2))
 
         tag = etree.Element('span')
         char_tag = etree.SubElement(tag, 'span', {
@@ -48,69 +56,76 @@ class UnicharPattern(markdown.inlinepatterns.Pattern):
             'data-name': name,
             'data-code': code,
         })
-        char_tag.text = self.displayChar(char, flags)
+        char_tag.text = text
 
-        info = self.postInfo(char, flags)
         if info:
             info_tag = etree.SubElement(tag, 'span')
             info_tag.text = ' ' + info
 
-        return tag
-
-    def parseFlags(self, flags):
-        return { x: 1 for x in list(flags) }
-
-    def parseChar(self, char):
-        """Converts wide char, number or name into Unicode char with len=1"""
-        ishex = re.match("^(?:U+)?([0-9A-F]{2,})$", char, re.I)
-        if len(char) == 1:
-            return char
-        elif ishex:
-            return chr(int(ishex.group(1), 16))
-        else:
-            try:
-                return unicodedata.lookup(char.encode('ascii'))
-            except KeyError:
-                raise Exception("Invalid u{...} value '" + char + "'")
-
-    def displayChar(self, char, flags):
-        if "!" in flags:
-            return "U+%04X" % ord(char)
-        else:
-            # ElementTree escapes it for us, using HTML entities if available.
-            html = char
-            if "'" in flags:
-                html = u'\u25CC' + char
-            return html
-
-    def postInfo(self, char, flags):
-        html = []
-        if "+" in flags:
-            html.append(self.getName(char))
-        if "#" in flags:
-            html.append("(U+%04X)" % ord(char))
-        return ' '.join(html)
-
-    def getName(self, char):
+        return tag, m.start(0), m.end(0)
+
+
+@lru_cache(maxsize=1024)
+def render_char(char, flags):
+    """The name, code, displayed text and any inline info for u{char...}
+    with the given flags. The same few characters tend to come up again
+    and again in an article, so these are kept."""
+    flags = set(flags)
+    if "!" in flags:
+        flags.discard('#')
+    char = parse_char(char)
+    name = char_name(char)
+    code = "%04X" % ord(char)
+
+    if "!" in flags:
+        text = "U+" + code
+    elif "'" in flags:
+        # ElementTree escapes it for us, using HTML entities if available.
+        text = '\u25CC' + char
+    else:
+        text = char
+
+    info = []
+    if "+" in flags:
+        info.append(name)
+    if "#" in flags:
+        info.append("(U+%s)" % code)
+    return name, code, text, ' '.join(info)
+
+
+@lru_cache(maxsize=1024)
+def parse_char(char):
+    """Converts wide char, number or name (or alias) into Unicode char with len=1"""
+    ishex = HEX_RE.match(char)
+    if len(char) == 1:
+        return char
+    elif ishex:
+        return chr(int(ishex.group(1), 16))
+    elif char.upper() in FALLBACK_CODES:
+        return chr(FALLBACK_CODES[char.upper()])
+    else:
         try:
-            return unicodedata.name(char)
-        except ValueError:
-            codepoint = ord(char)
-            # Python doesn't have these yet
-            if 0x1f1e6 <= codepoint <= 0x1f1ff:
-                letter = chr( ord('a') + (codepoint - 0x1f1e6) ).upper()
-                return "REGIONAL INDICATOR SYMBOL LETTER '" + letter + "'"
-            elif codepoint == 0x1f3e9:
-                return "LOVE HOTEL"
-            elif codepoint == 0x1f4a9:
-                return "PILE OF POO"
-            else:
-                return "<unnamed %04X>" % ord(char)
+            found = unicodedata.lookup(char)
+        except KeyError:
+            found = None
+        if found is None or len(found) != 1:
+            # Named sequences are several characters
+            raise Exception("Invalid u{...} value '" + char + "'")
+        return found
+
+
+@lru_cache(maxsize=1024)
+def char_name(char):
+    try:
+        return unicodedata.name(char)
+    except ValueError:
+        codepoint = ord(char)
+        return FALLBACK_NAMES.get(codepoint, "<unnamed %04X>" % codepoint)
+
 
 class UnicharExtension(markdown.Extension):
     def extendMarkdown(self, md, md_globals):
-        pat = UnicharPattern(UNICHAR_RE)
-        md.inlinePatterns.add('unichar', pat, '_end')
+        md.inlinePatterns.register(UnicharInlineProcessor(UNICHAR_RE, md), 'unichar', 45)
 
 def makeExtension(**kwargs):
     return UnicharExtension(**kwargs)
@@ -2,6 +2,7 @@ import re
 import unicodedata
 import types
 import sys
+from functools import lru_cache
 
 from html.entities import name2codepoint
 
@@ -13,8 +14,8 @@ import unidecode
 __all__ = ['slugify']
 
 
-# character entity reference
-CHAR_ENTITY_REXP = re.compile('&(%s);' % '|'.join(name2codepoint))
+# character entity reference; names are checked against name2codepoint
+CHAR_ENTITY_REXP = re.compile(r'&(\w+);')
 
 # decimal character reference
 DECIMAL_REXP = re.compile(r'&#(\d+);')
@@ -98,6 +99,61 @@ def slugify(
     if not isinstance(text, _unicode_type):
         text = _unicode(text, 'utf-8', 'ignore')
 
+    return _slugify(
+        text,
+        entities,
+        decimal,
+        hexadecimal,
+        max_length,
+        word_boundary,
+        separator,
+        save_order,
+        tuple(stopwords),
+    )
+
+
+@lru_cache(maxsize=4096)
+def _slugify(
+    text,
+    entities,
+    decimal,
+    hexadecimal,
+    max_length,
+    word_boundary,
+    separator,
+    save_order,
+    stopwords,
+):
+    # ASCII text without references is unchanged by decoding and translating
+    if not (text.isascii() and '&' not in text):
+        text = _decode(text, entities, decimal, hexadecimal)
+
+    # replace unwanted characters
+    text = REPLACE1_REXP.sub('', text.lower())  # replace ' with nothing instead with -
+    text = REPLACE2_REXP.sub('-', text.lower())
+
+    # remove redundant -
+    text = REMOVE_REXP.sub('-', text).strip('-')
+
+    # remove stopwords
+    if stopwords:
+        stopwords_lower = [s.lower() for s in stopwords]
+        words = [w for w in text.split(separator) if w not in stopwords_lower]
+        text = separator.join(words)
+
+    # smart truncate if requested
+    if max_length > 0:
+        text = smart_truncate(text, max_length, word_boundary, '-', save_order)
+
+    if separator != '-':
+        text = text.replace('-', separator)
+
+    return text
+
+
+def _decode(text, entities, decimal, hexadecimal):
+    """Transliterate text to ASCII, and decode character references"""
+
     # decode unicode
     text = unidecode.unidecode(text)
 
@@ -107,7 +163,7 @@ def slugify(
 
     # character entity reference
     if entities:
-        text = CHAR_ENTITY_REXP.sub(lambda m: chr(name2codepoint[m.group(1)]), text)
+        text = CHAR_ENTITY_REXP.sub(_entity, text)
 
     # decimal character reference
     if decimal:
@@ -124,31 +180,13 @@ def slugify(
             pass
 
     # translate
-    text = unicodedata.normalize('NFKD', text)
-    if sys.version_info < (3,):
-        text = text.encode('ascii', 'ignore')
-
-    # replace unwanted characters
-    text = REPLACE1_REXP.sub('', text.lower())  # replace ' with nothing instead with -
-    text = REPLACE2_REXP.sub('-', text.lower())
+    return unicodedata.normalize('NFKD', text)
 
-    # remove redundant -
-    text = REMOVE_REXP.sub('-', text).strip('-')
 
-    # remove stopwords
-    if stopwords:
-        stopwords_lower = [s.lower() for s in stopwords]
-        words = [w for w in text.split(separator) if w not in stopwords_lower]
-        text = separator.join(words)
-
-    # smart truncate if requested
-    if max_length > 0:
-        text = smart_truncate(text, max_length, word_boundary, '-', save_order)
-
-    if separator != '-':
-        text = text.replace('-', separator)
-
-    return text
+def _entity(m):
+    if m.group(1) in name2codepoint:
+        return chr(name2codepoint[m.group(1)])
+    return m.group(0)
 
 
 def main():
@@ -0,0 +1,42 @@
+// Replace an "Older articles" link under a page list with the articles it
+// leads to, fetched from its JSON shard, as the link scrolls into view.
+// Without javascript (or IntersectionObserver) the link still works.
+function add_infinite_scroll() {
+  var link = $(this);
+  var list = link.parent().prev("ul");
+  if (!("IntersectionObserver" in window)) {
+    return;
+  }
+
+  var loading = false;
+  var observer = new IntersectionObserver(function (entries) {
+    if (loading || !entries[0].isIntersecting) {
+      return;
+    }
+    loading = true;
+    $.getJSON(link.data("json"))
+      .done(function (data) {
+        $.each(data.pages, function (_, page) {
+          list.append(
+            $("<li>").append(
+              $("<span>").append($("<code>").text(page.date)),
+              $("<span>").text(" " + (page.featured ? "★" : "")),
+              $("<a>").attr("href", page.url).text(page.title)
+            )
+          );
+        });
+        if (data.more) {
+          link.attr("href", data.more.html).data("json", data.more.json);
+          loading = false;
+        } else {
+          observer.disconnect();
+          link.parent().remove();
+        }
+      })
+      .fail(function () {
+        // Leave the link for the reader to follow
+        observer.disconnect();
+      });
+  });
+  observer.observe(this);
+}
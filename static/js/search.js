@@ -0,0 +1,187 @@
+// Client for the search index built by blog/search.py. Queries are
+// tokenized the same way as the index, and only the shards holding their
+// tokens are fetched.
+// Key listing the parts of a shard split by second character, as
+// blog/search.py's SPLIT
+var SEARCH_SPLIT = " split";
+var SEARCH_JAPANESE = "[\\p{Script=Han}\\p{Script=Hiragana}\\p{Script=Katakana}ー々]";
+var SEARCH_WORD = "[\\p{Alphabetic}\\p{M}\\p{Nd}\\p{Pc}]";
+var SEARCH_TOKEN_RE = new RegExp(
+  "(" + SEARCH_JAPANESE + "+)|(?:(?!" + SEARCH_JAPANESE + ")" + SEARCH_WORD + ")+",
+  "gu"
+);
+
+// List of [token, is_word] in text
+function search_tokenize(text) {
+  var tokens = [];
+  var match;
+  text = text.normalize("NFKC").toLowerCase();
+  SEARCH_TOKEN_RE.lastIndex = 0;
+  while ((match = SEARCH_TOKEN_RE.exec(text)) !== null) {
+    var run = Array.from(match[0]);
+    if (match[1]) {
+      if (run.length == 1) {
+        tokens.push([run[0], false]);
+      }
+      for (var i = 0; i < run.length - 1; i++) {
+        tokens.push([run[i] + run[i + 1], false]);
+      }
+    } else {
+      tokens.push([match[0], true]);
+    }
+  }
+  return tokens;
+}
+
+function search_shard_key(token, length) {
+  var prefix = Array.from(token)
+    .slice(0, length || 1)
+    .join("");
+  return Array.from(new TextEncoder().encode(prefix))
+    .map(function (b) {
+      return ("0" + b.toString(16)).slice(-2);
+    })
+    .join("");
+}
+
+// Scores of documents containing token; or, if prefix, any token starting
+// with it (which must be in the shard from search_shard())
+function search_postings(shard, token, prefix) {
+  var scores = {};
+  $.each(shard, function (candidate, hits) {
+    if (candidate == token || (prefix && candidate.lastIndexOf(token, 0) === 0)) {
+      $.each(hits, function (_, hit) {
+        scores[hit[0]] = Math.max(scores[hit[0]] || 0, hit[1]);
+      });
+    }
+  });
+  return scores;
+}
+
+// Promise of the postings that token, or if prefix any token starting
+// with it, could be in: its shard, and as many parts as needed if the shard
+// was split
+function search_shard(fetch, token, prefix) {
+  return fetch(search_shard_key(token)).then(function (shard) {
+    var parts = shard[SEARCH_SPLIT];
+    if (!parts) {
+      return shard;
+    }
+    if (Array.from(token).length > 1) {
+      var key = search_shard_key(token, 2);
+      parts = parts.indexOf(key) >= 0 ? [key] : [];
+    } else if (!prefix) {
+      parts = [];
+    }
+    return $.when.apply($, [shard].concat(parts.map(fetch))).then(function () {
+      var merged = $.extend.apply($, [{}].concat(Array.prototype.slice.call(arguments)));
+      delete merged[SEARCH_SPLIT];
+      return merged;
+    });
+  });
+}
+
+// Function fetching the parts of the index under base, each only once
+function search_fetcher(base) {
+  var fetched = {};
+  return function (name) {
+    if (!(name in fetched)) {
+      // Pass on just the data: $.when would otherwise hand each shard over
+      // as [data, status, xhr]. A missing shard means none of its tokens
+      // are in any article.
+      fetched[name] = $.getJSON(base + name + ".json").then(
+        function (data) {
+          return data;
+        },
+        function () {
+          return $.Deferred().resolve({});
+        }
+      );
+    }
+    return fetched[name];
+  };
+}
+
+// Promise of the documents ([url, title, date]) holding every token of a
+// query, best first, using fetch from search_fetcher()
+function search_run(fetch, query) {
+  var tokens = search_tokenize(query);
+  if (!tokens.length) {
+    return $.Deferred().resolve([]).promise();
+  }
+  // Match the last word as a prefix, unless the query is finished with a
+  // space
+  var last = tokens[tokens.length - 1];
+  var prefix = last[1] && !/\s$/.test(query) ? last[0] : null;
+  var shards = tokens.map(function (token) {
+    return search_shard(fetch, token[0], token[0] === prefix);
+  });
+
+  return $.when.apply($, [fetch("documents")].concat(shards)).then(function (documents) {
+    var loaded = Array.prototype.slice.call(arguments, 1);
+    var totals = null;
+    tokens.forEach(function (token, i) {
+      var scores = search_postings(loaded[i], token[0], token[0] === prefix);
+      var next = {};
+      $.each(scores, function (doc, score) {
+        if (totals === null || doc in totals) {
+          next[doc] = (totals === null ? 0 : totals[doc]) + score;
+        }
+      });
+      totals = next;
+    });
+    var ranked = Object.keys(totals).sort(function (a, b) {
+      return totals[b] - totals[a] || a - b;
+    });
+    return ranked.map(function (doc) {
+      return documents[doc];
+    });
+  });
+}
+
+function add_search(form, results) {
+  var fetch = search_fetcher(results.data("index"));
+  var input = form.find("input");
+
+  function run(query) {
+    if (!search_tokenize(query).length) {
+      results.empty();
+      return;
+    }
+    search_run(fetch, query).done(function (found) {
+      if (search_tokenize(input.val()).join() != search_tokenize(query).join()) {
+        return; // The query has changed since
+      }
+      results.empty();
+      found.forEach(function (document) {
+        results.append(
+          $("<li>").append(
+            $("<span>").append($("<code>").text(document[2])),
+            " ",
+            $("<a>").attr("href", document[0]).text(document[1])
+          )
+        );
+      });
+      if (!found.length) {
+        results.append($("<li>").text("No articles found."));
+      }
+    });
+  }
+
+  var query = new URLSearchParams(window.location.search).get("q");
+  if (query) {
+    input.val(query);
+    run(query);
+  }
+  input.on("input", function () {
+    run(input.val());
+  });
+  form.on("submit", function (event) {
+    event.preventDefault();
+    run(input.val());
+  });
+}
+
+$(document).ready(function () {
+  add_search($("#search"), $("#search-results"));
+});
@@ -0,0 +1,152 @@
+// Run static/js/search.js, with the bundled jQuery, against a frozen
+// search index, without a browser:
+//
+//     node tests/search_harness.js BUILD_DIR QUERY...
+//
+// prints a JSON list of the titles found for each query. The DOM is only
+// faked as far as jQuery needs it to load; requests for the index are
+// answered from the files under BUILD_DIR.
+var fs = require("fs");
+var path = require("path");
+var vm = require("vm");
+
+var ROOT = path.join(__dirname, "..");
+
+function Node(name, type) {
+  this.nodeName = name.toUpperCase();
+  this.nodeType = type || 1;
+  this.childNodes = [];
+  this.attributes = {};
+  this.style = {};
+  this.ownerDocument = document;
+}
+Node.prototype = {
+  get firstChild() {
+    return this.childNodes[0] || null;
+  },
+  get lastChild() {
+    return this.childNodes[this.childNodes.length - 1] || null;
+  },
+  appendChild: function (child) {
+    this.childNodes.push(child);
+    child.parentNode = this;
+    return child;
+  },
+  removeChild: function (child) {
+    this.childNodes.splice(this.childNodes.indexOf(child), 1);
+    child.parentNode = null;
+    return child;
+  },
+  cloneNode: function (deep) {
+    var copy = new Node(this.nodeName, this.nodeType);
+    Object.assign(copy.attributes, this.attributes);
+    if (deep) {
+      this.childNodes.forEach(function (child) {
+        copy.appendChild(child.cloneNode(true));
+      });
+    }
+    return copy;
+  },
+  setAttribute: function (name, value) {
+    this.attributes[name] = String(value);
+  },
+  getAttribute: function (name) {
+    return name in this.attributes ? this.attributes[name] : null;
+  },
+  removeAttribute: function (name) {
+    delete this.attributes[name];
+  },
+  getElementsByTagName: function () {
+    return [];
+  },
+  querySelectorAll: function () {
+    return [];
+  },
+  addEventListener: function () {},
+  removeEventListener: function () {},
+};
+
+var document = new Node("#document", 9);
+// Never becomes ready, so search.js doesn't go looking for its form
+document.readyState = "loading";
+document.documentElement = new Node("html");
+document.createElement = function (name) {
+  return new Node(name);
+};
+document.createDocumentFragment = function () {
+  return new Node("#document-fragment", 11);
+};
+
+// Answers GETs with the file under the build directory
+function FakeXMLHttpRequest() {
+  this.withCredentials = false;
+}
+FakeXMLHttpRequest.prototype = {
+  open: function (method, url) {
+    this.url = url;
+  },
+  setRequestHeader: function () {},
+  getAllResponseHeaders: function () {
+    return "Content-Type: application/json\r\n";
+  },
+  send: function () {
+    var xhr = this;
+    setTimeout(function () {
+      var filename = path.join(BUILD, decodeURIComponent(xhr.url.split("?")[0]));
+      try {
+        xhr.responseText = fs.readFileSync(filename, "utf8");
+        xhr.status = 200;
+        xhr.statusText = "OK";
+      } catch (err) {
+        xhr.responseText = "";
+        xhr.status = 404;
+        xhr.statusText = "Not Found";
+      }
+      xhr.onload();
+    });
+  },
+  abort: function () {},
+};
+
+var BUILD = process.argv[2];
+var window = {
+  document: document,
+  location: { href: "http://localhost/search/", search: "" },
+  XMLHttpRequest: FakeXMLHttpRequest,
+  setTimeout: setTimeout,
+  clearTimeout: clearTimeout,
+  TextEncoder: TextEncoder,
+  URLSearchParams: URLSearchParams,
+  addEventListener: function () {},
+  removeEventListener: function () {},
+};
+window.window = window;
+vm.createContext(window);
+["static/js/vendor/jquery.js", "static/js/search.js"].forEach(function (filename) {
+  var source = fs.readFileSync(path.join(ROOT, filename), "utf8");
+  vm.runInContext(source, window, { filename: filename });
+});
+
+var fetch = window.search_fetcher("/search/");
+var queries = process.argv.slice(3);
+var found = [];
+(function next(i) {
+  if (i == queries.length) {
+    process.stdout.write(JSON.stringify(found) + "\n");
+    return;
+  }
+  window.search_run(fetch, queries[i]).then(
+    function (documents) {
+      found.push(
+        documents.map(function (document) {
+          return document[1];
+        })
+      );
+      next(i + 1);
+    },
+    function () {
+      console.error("search failed: " + queries[i]);
+      process.exit(1);
+    }
+  );
+})(0);
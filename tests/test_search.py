@@ -0,0 +1,125 @@
+"""Client-side search against a frozen index.
+
+Freezes the search index of a few articles, then runs static/js/search.js
+(with the bundled jQuery) over the files in node; see search_harness.js.
+The index is frozen again with every shard split, which must give the
+same results. Skipped if node isn't installed. Run with
+`python -m unittest`.
+"""
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+HARNESS = os.path.join(os.path.dirname(__file__), 'search_harness.js')
+
+ARTICLES = {
+    '2020-01-01-unicode.md': (
+        "Title: Unicode in Perl\n"
+        "Category: Programming\n"
+        "Tags: perl\n"
+        "Date: 2020-01-01 10:00\n\n"
+        "Decode your strings before you compare them.\n"
+    ),
+    '2020-02-01-kanji.md': (
+        "Title: Learning kanji\n"
+        "Category: Japanese\n"
+        "Tags: vocab\n"
+        "Date: 2020-02-01 10:00\n\n"
+        "漢字{かんじ}を勉強{べんきょう}した。\n"
+    ),
+    '2020-03-01-git.md': (
+        "Title: Git branches\n"
+        "Category: Programming\n"
+        "Tags: git\n"
+        "Date: 2020-03-01 10:00\n\n"
+        "Merge the branch once the tests pass.\n"
+    ),
+}
+
+# Frozen index, as built and with every shard split
+builds = []
+scratch = None
+
+
+def setUpModule():
+    global scratch
+    if shutil.which('node') is None:
+        raise unittest.SkipTest("node is not installed")
+    scratch = tempfile.mkdtemp(prefix='test-search-')
+    pages = os.path.join(scratch, 'pages')
+    os.mkdir(pages)
+    for name, text in ARTICLES.items():
+        with open(os.path.join(pages, name), 'w', encoding='utf-8') as handle:
+            handle.write(text)
+    # The app reads these when first imported
+    os.environ['BLOG_PAGES_DIR'] = pages
+    os.environ['BLOG_CACHE_DIR'] = os.path.join(scratch, 'cache')
+    import app
+    import blog.search
+    from freeze import freezer
+
+    for shard_bytes in (blog.search.SHARD_BYTES, 0):
+        blog.search.SHARD_BYTES = shard_bytes
+        app._search_index = (None, None)
+        build = os.path.join(scratch, 'build-{}'.format(shard_bytes))
+        app.app.config['FREEZER_DESTINATION'] = build
+        for url in freezer.all_urls():
+            if url.startswith('/search/') and url.endswith('.json'):
+                freezer._build_one(url)
+        builds.append(build)
+
+
+def tearDownModule():
+    shutil.rmtree(scratch)
+
+
+def search(*queries):
+    """Titles found for each query by search.js, the same from every
+    build"""
+    found = [
+        json.loads(
+            subprocess.run(
+                ['node', HARNESS, build] + list(queries),
+                check=True,
+                stdout=subprocess.PIPE,
+                universal_newlines=True,
+            ).stdout
+        )
+        for build in builds
+    ]
+    assert all(titles == found[0] for titles in found), found
+    return found[0]
+
+
+class SearchTest(unittest.TestCase):
+    def test_word(self):
+        self.assertEqual(search('strings'), [['Unicode in Perl']])
+
+    def test_words(self):
+        self.assertEqual(search('merge branch'), [['Git branches']])
+        self.assertEqual(search('merge strings'), [[]])
+
+    def test_prefix(self):
+        self.assertEqual(
+            search('stri', 'bran', 'm'), [['Unicode in Perl'], ['Git branches'], ['Git branches']]
+        )
+
+    def test_prefix_finished(self):
+        # A space after the last word ends it
+        self.assertEqual(search('stri '), [[]])
+
+    def test_title(self):
+        self.assertEqual(search('learning'), [['Learning kanji']])
+
+    def test_japanese(self):
+        self.assertEqual(search('漢字', '勉強', 'べんきょう'), [['Learning kanji']] * 3)
+
+    def test_missing(self):
+        self.assertEqual(search('zebra', 'ゼブラ'), [[], []])
+
+
+if __name__ == '__main__':
+    unittest.main()